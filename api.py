@@ -1,20 +1,37 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import queue
+import atexit
 import os
 from dotenv import load_dotenv
-import joblib
+from joblib import Parallel, delayed
 import numpy as np
-from models.PortfolioOptimizer import PortfolioOptimizer
+import orjson
+from models.PortfolioOptimizer import PortfolioOptimizer, MODELS_DIR
+from models.modelos_onnx import carregar_modelo, onnx_path_for, usar_onnx
 from datas.salva_base_localmente import executar_pipeline_local
 
 # Carregar variáveis de ambiente
 load_dotenv(override=True)
 
 
+class OrjsonProvider(JSONProvider):
+    """Serialização JSON com orjson, que codifica escalares e arrays numpy diretamente"""
+
+    def dumps(self, obj, **kwargs):
+        # OPT_SORT_KEYS mantém as chaves ordenadas como no provider padrão do Flask
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Inicializar aplicação Flask
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Configurar logging
@@ -26,8 +43,29 @@ file_handler.setFormatter(logging.Formatter(
     '%(asctime)s %(levelname)s: %(message)s [em %(pathname)s:%(lineno)d]'
 ))
 file_handler.setLevel(logging.INFO)
-app.logger.addHandler(file_handler)
+
+# As requisições apenas enfileiram os registros; a escrita no arquivo fica com uma thread dedicada
+queue_handler = QueueHandler(queue.Queue(-1))
+app.logger.addHandler(queue_handler)
 app.logger.setLevel(logging.INFO)
+
+# Mensagens do otimizador no mesmo arquivo. Padrão WARNING: o progresso de cada requisição (INFO) só é
+# registrado com LOGLEVEL=INFO.
+optimizer_logger = logging.getLogger('models.PortfolioOptimizer')
+optimizer_logger.addHandler(queue_handler)
+optimizer_logger.setLevel((os.environ.get('LOGLEVEL') or 'WARNING').upper())
+
+def start_log_listener():
+    """Inicia a thread que grava os logs. Refeito no processo filho após um fork (gunicorn --preload)."""
+    global log_listener
+    queue_handler.queue = queue.Queue(-1)
+    log_listener = QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    log_listener.start()
+
+start_log_listener()
+os.register_at_fork(after_in_child=start_log_listener)
+atexit.register(lambda: log_listener.stop())
+
 app.logger.info('ML API started')
 
 @app.route('/health', methods=['GET'])
@@ -45,23 +83,27 @@ def predict():
         data = request.get_json()
         benchmark_ticker = data['benchmark_ticker']
         user_tickers = data['user_tickers']
-        download_tickers = data['user_tickers'].copy()
-        download_tickers.append(benchmark_ticker)
+        # dict.fromkeys remove duplicatas (ex.: benchmark também listado em user_tickers) mantendo a ordem
+        download_tickers = list(dict.fromkeys([*user_tickers, benchmark_ticker]))
         
         start_date = data['start_date']
         end_date = data['end_date']
-        caminho = 'datas/dados_base_predict.csv'
         
-        app.logger.info(f'Downloading data from {start_date} to {end_date} for tickers {user_tickers}: {caminho}')
-        executar_pipeline_local(download_tickers, start_date, end_date, caminho)
+        # Os dados ficam em memória (o download já tem cache em disco), sem gravar e reler um arquivo
+        app.logger.info('Downloading data from %s to %s for tickers %s', start_date, end_date, user_tickers)
+        df_total = executar_pipeline_local(download_tickers, start_date, end_date, caminho=None)
+        if df_total.empty:
+            app.logger.error('No data returned for tickers %s from %s to %s', download_tickers, start_date, end_date)
+            return jsonify({
+                'error': 'No data',
+                'message': f'No market data found for tickers {download_tickers} from {start_date} to {end_date}'
+            }), 422
         
         app.logger.info('Initializing optimizer...')
-        optimizer = PortfolioOptimizer(caminho, user_tickers, benchmark_ticker)
+        optimizer = PortfolioOptimizer.from_dataframe(df_total, user_tickers, benchmark_ticker)
         
-        app.logger.info('Reading models...')
-        models_dict = optimizer.read_joblib()
-        models_to_use = {k: v for k, v in models_dict.items() if k in user_tickers}
-        app.logger.info(f'Models to use: {models_to_use}')
+        models_to_use = get_models(user_tickers)
+        app.logger.info('Models to use: %s', list(models_to_use))
         
         try:
             app.logger.info('Preparing features...')
@@ -109,10 +151,40 @@ def internal_error(error):
         'message': 'An internal server error occurred'
     }), 500
     
+# Cache de modelos por ticker: {ticker: (mtime do arquivo, modelo)}
+MODEL_CACHE = {}
+
+def get_models(tickers):
+    """Devolve os modelos dos tickers pedidos, lendo do disco apenas os ausentes ou alterados"""
+    found, to_read = [], []
+    for ticker in tickers:
+        model_path = os.path.join(MODELS_DIR, f'ml_model_{ticker}.joblib')
+        if not os.path.exists(model_path):
+            continue
+        found.append(ticker)
+        # Usa a versão ONNX (gerada por models/modelos_onnx.py) quando ela existe e não é mais antiga que o .joblib
+        onnx_path = onnx_path_for(model_path)
+        use_onnx = usar_onnx(model_path)
+        mtime = os.path.getmtime(onnx_path if use_onnx else model_path)
+        if ticker not in MODEL_CACHE or MODEL_CACHE[ticker][0] != mtime:
+            app.logger.info('Reading model for %s (%s)...', ticker, 'onnx' if use_onnx else 'joblib')
+            to_read.append((ticker, mtime, model_path))
+
+    # Os modelos ausentes do cache são lidos em paralelo (threads: leitura de disco e desserialização liberam o GIL)
+    loaded = Parallel(n_jobs=-1, prefer='threads')(
+        delayed(carregar_modelo)(model_path) for _, _, model_path in to_read
+    )
+    for (ticker, mtime, _), model in zip(to_read, loaded):
+        MODEL_CACHE[ticker] = (mtime, model)
+    return {ticker: MODEL_CACHE[ticker][1] for ticker in found}
+
 def load_models():
-    return True
+    """Pré-carrega todos os modelos disponíveis para que a primeira requisição já os encontre em cache"""
+    tickers = [os.path.splitext(f)[0].replace('ml_model_', '') for f in os.listdir(MODELS_DIR) if f.endswith('.joblib')]
+    return get_models(tickers)
+
+load_models()
 
 if __name__ == '__main__':
-    load_models()
     port = int(os.environ.get('PORT', 5150))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG', '0') == '1')
@@ -1,8 +1,13 @@
 from datas.salva_base_localmente import buscar_dados_historicos
 from models.PortfolioOptimizer import PortfolioOptimizer
 from datetime import datetime
+import logging
+import os
 import pandas as pd
 
+# Mensagens do otimizador. Padrão WARNING: progresso e resultados (INFO) só aparecem com LOGLEVEL=INFO
+logging.basicConfig(level=(os.environ.get('LOGLEVEL') or 'WARNING').upper(), format='%(message)s')
+
 tickers = ['AAPL','GOOG','AMZN', 'NFLX', 'MSFT', 'IBM','^GSPC']
 
 tickers_2 = ['AAPL','GOOG','AMZN', 'NFLX', 'MSFT', 'IBM']
@@ -25,7 +30,7 @@ models_dict = optimizer.read_joblib()
 
 resultado = optimizer.optimize_ml_portfolio(models_dict, features_df)
 
-optimizer.backtest_portfolio(weights_input=resultado['weights'], start_date_str=None, end_date_str=None)
+optimizer.backtest_portfolio(weights_input=resultado['weights'], start_date_str=None, end_date_str=None, plot=True)
 
 optimizer.calculate_portfolio_performance(weights=list(resultado['weights'].values()))
 
@@ -1,29 +1,42 @@
 import yfinance as yf
 import pandas as pd
-import boto3
-from io import BytesIO
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow.fs import S3FileSystem
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
 def buscar_dados_historicos(tickers, start, end, intervalo='1d'):
-    frames = []
+    print(f"Baixando dados de {', '.join(tickers)} de {start} até {end}...")
+    # Uma única chamada para todos os tickers: o yfinance baixa em paralelo (threads)
+    dados = yf.download(tickers, start=start, end=end, interval=intervalo, group_by='ticker', threads=True)
+
+    if dados.empty:
+        print("Nenhum dado foi baixado.")
+        return pd.DataFrame()
 
+    # Versões antigas do yfinance devolvem colunas simples quando há um único ticker
+    if not isinstance(dados.columns, pd.MultiIndex):
+        dados = pd.concat({tickers[0]: dados}, axis=1)
+
+    frames = []
     for ticker in tickers:
-        print(f"Baixando dados de {ticker} de {start} até {end}...")
-        df = yf.download(ticker, start=start, end=end, interval=intervalo)
+        if ticker not in dados.columns.get_level_values(0):
+            print(f"Nenhum dado retornado para {ticker}.")
+            continue
 
+        # Remove as datas em que apenas os outros tickers tiveram negociação
+        df = dados[ticker].dropna(how='all')
         if df.empty:
             print(f"Nenhum dado retornado para {ticker}.")
             continue
 
-        # Ajusta colunas, se necessário
-        if isinstance(df.columns, pd.MultiIndex):
-            df.columns = df.columns.get_level_values(0)
-
         df = df.copy()
+        df.columns.name = None
         df.reset_index(inplace=True)
         df['ticker'] = ticker
 
@@ -36,28 +49,31 @@ def buscar_dados_historicos(tickers, start, end, intervalo='1d'):
         print("Nenhum dado foi baixado.")
         return pd.DataFrame()
 
+def _gravar_particao(s3, path, grupo):
+    try:
+        pq.write_table(pa.Table.from_pandas(grupo, preserve_index=False), path, filesystem=s3, compression='snappy')
+        print(f"Salvo: s3://{path}")
+    except Exception as e:
+        print(f"Erro ao salvar {path}: {e}")
+
+
 def salvar_em_s3_particionado(df, bucket):
     if 'Date' not in df.columns:
         raise ValueError("Coluna 'Date' não encontrada no DataFrame.")
 
     df['Date'] = pd.to_datetime(df['Date'])
-    s3 = boto3.client( 's3',
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+    s3 = S3FileSystem(
+        access_key=os.getenv("AWS_ACCESS_KEY_ID"),
+        secret_key=os.getenv("AWS_SECRET_ACCESS_KEY")
     )
 
-    for (ticker, ano), grupo in df.groupby(["ticker", df['Date'].dt.year]):
-        path = f"dados_financeiros/ticker={ticker}/year={ano}/dados.parquet"
-
-        parquet_buffer = BytesIO()
-        grupo.to_parquet(parquet_buffer, index=False, engine='pyarrow', compression='snappy')
-        parquet_buffer.seek(0)
-
-        try:
-            s3.put_object(Bucket=bucket, Key=path, Body=parquet_buffer.getvalue())
-            print(f"Salvo: s3://{bucket}/{path}")
-        except Exception as e:
-            print(f"Erro ao salvar {path}: {e}")
+    # Mesmo layout lido pelos notebooks: dados_financeiros/ticker=<ticker>/year=<ano>/dados.parquet, com
+    # o ticker (sem codificação) no caminho e todas as colunas, inclusive 'ticker', dentro do arquivo.
+    # Os uploads de cada partição são feitos em paralelo (threads: o tempo é de rede, fora do GIL).
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for (ticker, ano), grupo in df.groupby(["ticker", df['Date'].dt.year]):
+            path = f"{bucket}/dados_financeiros/ticker={ticker}/year={ano}/dados.parquet"
+            executor.submit(_gravar_particao, s3, path, grupo)
 
 
 
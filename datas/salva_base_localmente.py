@@ -1,23 +1,64 @@
 import yfinance as yf
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from joblib import Memory
+import json
 import os
 
+# Cache em disco das respostas do yfinance, chaveado por (tickers, start, end, intervalo). Só períodos já
+# encerrados são guardados, e o cache é podado a cada nova entrada (tamanho, quantidade e idade máximos).
+memoria = Memory('cache/yf', verbose=0)
+CACHE_YF_MAX_BYTES = 256 * 1024 ** 2
+CACHE_YF_MAX_ITENS = 200
+CACHE_YF_IDADE_MAXIMA = timedelta(days=30)
+
+@memoria.cache
+def _baixar_yfinance(tickers, start, end, intervalo):
+    # Uma única chamada para todos os tickers: o yfinance baixa em paralelo (threads)
+    dados = yf.download(list(tickers), start=start, end=end, interval=intervalo, group_by='ticker', threads=True)
+
+    # Exceções não são gravadas no cache, então uma falha de download não fica memorizada
+    if dados.empty:
+        raise ValueError("Nenhum dado retornado pelo yfinance.")
+    return dados
+
 def buscar_dados_historicos(tickers, start, end, intervalo='1d'):
-    frames = []
+    print(f"Baixando dados de {', '.join(tickers)} de {start} até {end}...")
+    # Tickers normalizados para que a chave do cache não dependa da ordem da lista
+    argumentos = (tuple(sorted(set(tickers))), start, end, intervalo)
+    try:
+        if end is None or pd.Timestamp(end).date() >= date.today():
+            # Período que ainda não terminou: os dados de hoje (e de datas futuras) ainda podem mudar,
+            # então o download não é guardado no cache
+            dados = _baixar_yfinance.func(*argumentos)
+        else:
+            nova_entrada = not _baixar_yfinance.check_call_in_cache(*argumentos)
+            dados = _baixar_yfinance(*argumentos)
+            if nova_entrada:
+                memoria.reduce_size(bytes_limit=CACHE_YF_MAX_BYTES, items_limit=CACHE_YF_MAX_ITENS,
+                                age_limit=CACHE_YF_IDADE_MAXIMA)
+    except ValueError:
+        print("Nenhum dado foi baixado.")
+        return pd.DataFrame()
+
+    # Versões antigas do yfinance devolvem colunas simples quando há um único ticker
+    if not isinstance(dados.columns, pd.MultiIndex):
+        dados = pd.concat({tickers[0]: dados}, axis=1)
 
+    frames = []
     for ticker in tickers:
-        print(f"Baixando dados de {ticker} de {start} até {end}...")
-        df = yf.download(ticker, start=start, end=end, interval=intervalo)
+        if ticker not in dados.columns.get_level_values(0):
+            print(f"Nenhum dado retornado para {ticker}.")
+            continue
 
+        # Remove as datas em que apenas os outros tickers tiveram negociação
+        df = dados[ticker].dropna(how='all')
         if df.empty:
             print(f"Nenhum dado retornado para {ticker}.")
             continue
 
-        if isinstance(df.columns, pd.MultiIndex):
-            df.columns = df.columns.get_level_values(0)
-
         df = df.copy()
+        df.columns.name = None
         df.reset_index(inplace=True)
         df['ticker'] = ticker
 
@@ -33,18 +74,56 @@ def buscar_dados_historicos(tickers, start, end, intervalo='1d'):
 
 def salvar_localmente(df, caminho='datas/dados_base.csv'):
     os.makedirs(os.path.dirname(caminho), exist_ok=True)
-    df.to_csv(caminho, index=False)
+    # Caminhos .parquet gravam em Parquet, que preserva os tipos das colunas e evita a formatação/parse de texto do CSV
+    if caminho.endswith('.parquet'):
+        df.to_parquet(caminho, index=False, engine='pyarrow', compression='snappy')
+    else:
+        df.to_csv(caminho, index=False)
     print(f"Base salva localmente em: {caminho}")
 
+def _caminho_parametros(caminho):
+    return f"{caminho}.json"
+
+def base_local_atualizada(caminho, parametros):
+    """Indica se a base em `caminho` foi gerada com os mesmos parâmetros de download."""
+    if not os.path.exists(caminho) or not os.path.exists(_caminho_parametros(caminho)):
+        return False
+    with open(_caminho_parametros(caminho), encoding='utf-8') as f:
+        return json.load(f) == parametros
+
+def ler_localmente(caminho):
+    if caminho.endswith('.parquet'):
+        return pd.read_parquet(caminho)
+    return pd.read_csv(caminho)
+
 def executar_pipeline_local(tickers, start, end, caminho='datas/dados_base.csv'):
-    
+    """
+    Baixa os dados históricos e devolve o DataFrame em memória.
+    Se `caminho` for informado, a base também é gravada em disco (e reaproveitada se já estiver atualizada);
+    com `caminho=None` nada é gravado.
+    """
+    if caminho is None:
+        return buscar_dados_historicos(tickers, start, end, intervalo="1d")
+
+    parametros = {'tickers': sorted(set(tickers)), 'start': start, 'end': end, 'intervalo': '1d'}
+    if base_local_atualizada(caminho, parametros):
+        print(f"Base local já atualizada para os parâmetros informados: {caminho}")
+        return ler_localmente(caminho)
+
+    # Invalida os parâmetros antigos antes de sobrescrever a base
+    if os.path.exists(_caminho_parametros(caminho)):
+        os.remove(_caminho_parametros(caminho))
+
     df = buscar_dados_historicos(tickers, start, end, intervalo="1d")
     if not df.empty:
         # print("Estrutura final dos dados:")
         # print(df[['Date', 'ticker', 'Open', 'Close']].head())
         salvar_localmente(df, caminho)
+        with open(_caminho_parametros(caminho), 'w', encoding='utf-8') as f:
+            json.dump(parametros, f)
     else:
         print("Nenhum dado para salvar.")
+    return df
 
 if __name__ == "__main__":
     tickers = ['AAPL','GOOG','AMZN', 'NFLX', 'MSFT', 'IBM','^GSPC']
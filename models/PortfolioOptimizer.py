@@ -30,13 +30,191 @@ from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, r2_score
 import datetime 
-import json
-import joblib
+import logging
+import orjson
+from joblib import Parallel, delayed
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+try:
+    from models._ml_kernels import build_features
+except ModuleNotFoundError as e:
+    # Executado de dentro de models/ (notebooks, `python models/PortfolioOptimizer.py`): coloca a raiz do
+    # repositório no path para importar os kernels sempre como models.* (o cache do Numba guarda o nome
+    # do módulo em que cada kernel foi compilado)
+    if e.name != 'models':
+        raise
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from models._ml_kernels import build_features
+from models._backtest_kernels import cumulative_drawdown
+
+# Mensagens de progresso em INFO e avisos/erros em WARNING/ERROR. O nível e a saída são definidos por
+# quem usa o módulo (api.py, aplica_modelo.py, main_run, notebooks), não aqui.
+logger = logging.getLogger(__name__)
 
 # --- Configurações Globais --- 
 # Usada no cálculo do Índice de Sharpe. Um valor comum é 2% (0.02).
 RISK_FREE_RATE = 0.02
+# Diretório com os modelos treinados (um arquivo .joblib por ticker).
+# Relativo a este arquivo, para funcionar tanto da raiz do repositório quanto de dentro de models/.
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trained_models')
+# Colunas da base histórica consumidas pelo otimizador e seus tipos.
+DATA_COLUMNS = ['Date', 'ticker', 'Close']
+DATA_DTYPES = {'Close': 'float32', 'ticker': 'category'}
+# Mínimo de dias de retornos para a etapa de ML do main_run. É uma heurística; pode precisar de ajuste.
+MIN_DAYS_FOR_ML = 90 + 30 + 30 + 60 # Aprox: maior janela feature + janela target + período de teste
+# Linha separadora das mensagens de início e fim do main_run.
+_BANNER = "=" * 80
+
+
+def cholesky_or_none(cov_matrix):
+    """Fator de Cholesky L (cov = L @ L.T), ou None se a covariância for singular (ex: ativos com retornos idênticos)."""
+    try:
+        return np.linalg.cholesky(cov_matrix)
+    except np.linalg.LinAlgError:
+        return None
+
+
+def sharpe_objective(mean_returns, cov_matrix, cov_cholesky, risk_free_rate):
+    """
+    Função objetivo `objective(weights) -> (-sharpe, gradiente)` para `minimize(..., jac=True)`.
+    Usa o fator de Cholesky quando disponível; sem ele, a matriz de covariância completa.
+    """
+    def objective(weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        excess_return = mean_returns @ weights - risk_free_rate
+        if cov_cholesky is not None:
+            # Com cov = L @ L.T: variância = ||L.T @ w||² e cov @ w = L @ (L.T @ w)
+            lt_w = cov_cholesky.T @ weights
+            variance = lt_w @ lt_w
+            cov_w = cov_cholesky @ lt_w
+        else:
+            cov_w = cov_matrix @ weights
+            variance = weights @ cov_w
+        if variance <= 0:
+            return 0.0, np.zeros_like(weights)
+        volatility = np.sqrt(variance)
+        sharpe = excess_return / volatility
+        # d(sharpe)/dw = média / vol - (retorno - rf) * (cov @ w) / vol³
+        gradient = mean_returns / volatility - excess_return * cov_w / (variance * volatility)
+        return -sharpe, -gradient
+
+    return objective
+
+
+def atomic_write(filename, write):
+    """
+    Escrita atômica: `write(f)` grava em um arquivo temporário (binário), que é sincronizado em disco e
+    renomeado por cima de `filename`. Quem lê o arquivo nunca o encontra escrito pela metade (nem após
+    uma falha no meio); se `write` falhar, o temporário é removido e o erro é propagado.
+    """
+    tmp_filename = filename + '.tmp'
+    try:
+        with open(tmp_filename, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def backtest_metrics(daily_returns, risk_free_rate, cumulative_out=None):
+    """
+    Métricas de desempenho de uma série de retornos diários de portfólio (array numpy float64).
+
+    Args:
+        daily_returns (np.ndarray): Retornos diários do portfólio no período do backtest.
+        risk_free_rate (float): Taxa livre de risco anual.
+        cumulative_out (np.ndarray, optional): Array do mesmo tamanho que recebe os retornos acumulados.
+
+    Returns:
+        dict: 'total_return', 'annual_return', 'volatility', 'sharpe_ratio', 'max_drawdown' e 'num_days'
+              (métricas NaN se não houver dias no período).
+    """
+    num_days = len(daily_returns)
+    if num_days == 0:
+        return {'total_return': np.nan, 'annual_return': np.nan, 'volatility': np.nan,
+                'sharpe_ratio': np.nan, 'max_drawdown': np.nan, 'num_days': 0}
+    if cumulative_out is None:
+        cumulative_out = np.empty_like(daily_returns)
+
+    # Retornos acumulados, (1 + r1) * (1 + r2) * ... * (1 + rn), e Máximo Drawdown (maior queda
+    # percentual do pico ao vale durante o período) na mesma passada.
+    max_drawdown = cumulative_drawdown(daily_returns, cumulative_out)
+    total_return = float(cumulative_out[-1] - 1)
+
+    # Retorno anualizado: ( (1 + Retorno Total) ^ (252 / Número de Dias) ) - 1
+    annual_return = (1 + total_return) ** (252 / num_days) - 1
+
+    # Volatilidade anualizada: Desvio padrão dos retornos diários * sqrt(252)
+    volatility = float(daily_returns.std(ddof=1) * np.sqrt(252)) if num_days > 1 else np.nan
+
+    # Índice de Sharpe anualizado
+    sharpe_ratio = (annual_return - risk_free_rate) / volatility if volatility != 0 else 0.0
+
+    return {'total_return': total_return, 'annual_return': annual_return, 'volatility': volatility,
+            'sharpe_ratio': sharpe_ratio, 'max_drawdown': max_drawdown, 'num_days': num_days}
+
+
+# Estado dos processos de batch_backtest: retornos lidos da memória compartilhada criada pelo processo principal
+_worker_state = {}
+
+
+def _init_backtest_worker(shm_name, shape, dtype, risk_free_rate):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_state['shm'] = shm  # Mantém a referência para o buffer continuar válido
+    _worker_state['returns'] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    _worker_state['risk_free_rate'] = risk_free_rate
+
+
+def _run_backtest_task(task):
+    _, weight_array, start_pos, end_pos = task
+    daily_returns = _worker_state['returns'][start_pos:end_pos] @ weight_array
+    return backtest_metrics(daily_returns, _worker_state['risk_free_rate'])
+
+
+class _RollingMoments:
+    """
+    Média e covariância amostral de uma janela deslizante de `window` linhas sobre uma matriz de
+    retornos (dias x tickers), mantidas por somas correntes: avançar um dia soma a linha que entra
+    e subtrai a que sai (O(tickers²)), em vez de recalcular a janela inteira (O(window x tickers²)).
+    Para não acumular erro de arredondamento, as somas são recalculadas do zero a cada `recompute_every` avanços.
+    """
+
+    def __init__(self, returns, window, recompute_every=252):
+        self.returns = np.asarray(returns, dtype=np.float64)
+        self.window = window
+        self.recompute_every = recompute_every
+        self.end = window  # A janela atual é returns[end - window:end]
+        self.recompute()
+
+    def recompute(self):
+        X = self.returns[self.end - self.window:self.end]
+        self.sum = X.sum(axis=0)
+        self.cross = X.T @ X
+        self.advances = 0
+
+    def advance(self):
+        x_old = self.returns[self.end - self.window]
+        x_new = self.returns[self.end]
+        self.end += 1
+        self.advances += 1
+        if self.advances >= self.recompute_every:
+            self.recompute()
+            return
+        self.sum += x_new - x_old
+        self.cross += np.outer(x_new, x_new) - np.outer(x_old, x_old)
+
+    def mean(self):
+        return self.sum / self.window
+
+    def cov(self):
+        return (self.cross - np.outer(self.sum, self.sum) / self.window) / (self.window - 1)
+
 
 class PortfolioOptimizer:
     """
@@ -50,47 +228,114 @@ class PortfolioOptimizer:
         Inicializa o otimizador de portfólio.
 
         Args:
-            df_total_data (pd.DataFrame): DataFrame contendo os dados históricos dos ativos e do benchmark
+            data_file (str or pd.DataFrame): Caminho da base histórica (.csv ou .parquet) ou um DataFrame
+                                             já carregado com os dados dos ativos e do benchmark.
             tickers_list (list): Lista de strings contendo os tickers (símbolos) dos ativos
                                  que farão parte do portfólio a ser otimizado.
             benchmark_ticker (str): String do ticker do ativo que será usado como benchmark
                                     (ex: '^GSPC' para o S&P 500).
             risk_free_rate (float, optional): A taxa livre de risco anual. Padrão é o valor global RISK_FREE_RATE.
         """
-        # Armazena os dados de entrada e parâmetros
-        self.df_total = self.get_data(data_file)
+        # Armazena os dados de entrada e parâmetros. De um DataFrame ou Parquet, só as linhas dos tickers
+        # usados (portfólio + benchmark) são convertidas e guardadas; load_data filtra o restante.
+        relevant_tickers = list(tickers_list) + [benchmark_ticker]
+        if isinstance(data_file, pd.DataFrame):
+            self.df_total = self.prepare_data(data_file, relevant_tickers)
+        else:
+            self.df_total = self.get_data(data_file, relevant_tickers)
         self.tickers_list = tickers_list.copy()  # Make a copy of the input list
+        # Posição de cada ticker nos arrays de pesos/retornos (ordem de tickers_list)
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers_list)}
         self.benchmark_ticker = benchmark_ticker
         self.risk_free_rate = risk_free_rate
 
         # Atributos que serão populados após o carregamento e processamento dos dados
-        self.returns_data = None      # DataFrame com os retornos diários dos ativos do portfólio.
-        self.prices_data = None       # DataFrame com os preços de fechamento dos ativos do portfólio.
-        self.benchmark_returns = None # Series com os retornos diários do benchmark.
+        # Os dados ficam em arrays numpy float32 contíguos (um por grandeza) com os índices de datas à parte;
+        # returns_data, prices_data e benchmark_returns os expõem como DataFrame/Series sem cópia.
+        self.returns_array = None       # Retornos diários dos ativos do portfólio (dias x tickers).
+        self.prices_array = None        # Preços de fechamento dos ativos do portfólio (dias x tickers).
+        self.benchmark_array = None     # Retornos diários do benchmark (dias).
+        self.returns_dates = None       # DatetimeIndex dos retornos (e do benchmark).
+        self.prices_dates = None        # DatetimeIndex dos preços (inclui o primeiro dia, sem retorno).
+        self.returns_dates_ns = None    # Datas dos retornos como inteiros int64 (ns), para buscas binárias.
+        self.mean_returns_annual = None # Array com os retornos médios anualizados dos ativos.
+        self.cov_matrix_annual = None   # Matriz de covariância anualizada dos retornos dos ativos.
+        self.cov_cholesky = None        # Fator de Cholesky L da covariância anualizada (cov = L @ L.T), se ela for definida positiva.
 
         # Chama o método para carregar e processar os dados assim que a classe é instanciada.
         self.load_data()
     
+    @property
+    def returns_data(self):
+        """DataFrame com os retornos diários dos ativos do portfólio (sobre `returns_array`, sem cópia)."""
+        if self.returns_array is None:
+            return None
+        return pd.DataFrame(self.returns_array, index=self.returns_dates, columns=self.tickers_list, copy=False)
+
+    @property
+    def prices_data(self):
+        """DataFrame com os preços de fechamento dos ativos do portfólio (sobre `prices_array`, sem cópia)."""
+        if self.prices_array is None:
+            return None
+        return pd.DataFrame(self.prices_array, index=self.prices_dates, columns=self.tickers_list, copy=False)
+
+    @property
+    def benchmark_returns(self):
+        """Series com os retornos diários do benchmark (sobre `benchmark_array`, sem cópia)."""
+        if self.benchmark_array is None:
+            return None
+        return pd.Series(self.benchmark_array, index=self.returns_dates, name=self.benchmark_ticker, copy=False)
+
+    @classmethod
+    def from_dataframe(cls, df_total, tickers_list, benchmark_ticker, risk_free_rate=RISK_FREE_RATE):
+        """Cria o otimizador a partir de um DataFrame em memória, sem passar por arquivo."""
+        return cls(df_total, tickers_list, benchmark_ticker, risk_free_rate)
+
     @staticmethod
-    def get_data(data_file):
-        df_total = pd.read_csv(data_file)
-        #Ajustar os tipos de colunas
-        df_total['Date'] = pd.to_datetime(df_total['Date']) 
-        df_total['Close'] = df_total['Close'].astype(float)
-        df_total['High'] = df_total['High'].astype(float)
-        df_total['Low'] = df_total['Low'].astype(float)
-        df_total['Open'] = df_total['Open'].astype(float)
-        df_total['Volume'] = df_total['Volume'].astype(int)
-        df_total['ticker'] = df_total['ticker'].astype(str)
+    def prepare_data(df_total, tickers=None):
+        # Mantém apenas as colunas usadas na otimização (e, se dados, apenas as linhas dos `tickers`),
+        # com os tipos finais: as conversões são feitas só sobre as linhas que serão usadas
+        rows = df_total['ticker'].isin(tickers) if tickers is not None else slice(None)
+        df_total = df_total.loc[rows, DATA_COLUMNS].astype(DATA_DTYPES)
+        df_total['Date'] = pd.to_datetime(df_total['Date'], format='ISO8601')
         return df_total
 
+    @staticmethod
+    def pivot_prices(df):
+        """
+        Equivalente a `df.pivot(index='Date', columns='ticker', values='Close').sort_index()`, montado
+        diretamente em numpy: datas e tickers viram códigos inteiros e cada preço é escrito na sua
+        posição (linha = data, coluna = ticker) de uma matriz pré-alocada, em uma única passada.
+        """
+        date_codes, dates = pd.factorize(df['Date'], sort=True)
+        ticker_codes, tickers = pd.factorize(df['ticker'], sort=True)
+
+        # Assim como o pivot, não aceita mais de um preço para o mesmo par (data, ticker)
+        cells = date_codes.astype(np.int64) * len(tickers) + ticker_codes
+        if np.bincount(cells, minlength=len(dates) * len(tickers)).max(initial=0) > 1:
+            raise ValueError("Os dados contêm mais de um preço para o mesmo par (Date, ticker).")
+
+        prices = np.full((len(dates), len(tickers)), np.nan, dtype=np.float32)
+        prices[date_codes, ticker_codes] = df['Close'].to_numpy(dtype=np.float32)
+        return pd.DataFrame(prices, index=pd.DatetimeIndex(dates, name='Date'),
+                            columns=pd.Index(np.asarray(tickers), name='ticker'), copy=False)
+
+    @staticmethod
+    def get_data(data_file, tickers=None):
+        # Lê apenas as colunas usadas na otimização, já com os tipos finais (evita inferência e conversões).
+        # No Parquet, o filtro por `tickers` é aplicado na leitura (só os row groups/linhas necessários).
+        if str(data_file).endswith('.parquet'):
+            filters = [('ticker', 'in', list(tickers))] if tickers is not None else None
+            return PortfolioOptimizer.prepare_data(pd.read_parquet(data_file, columns=DATA_COLUMNS, filters=filters))
+        return pd.read_csv(data_file, usecols=DATA_COLUMNS, dtype=DATA_DTYPES, parse_dates=['Date'], date_format='ISO8601')
+
     def load_data(self):
         """
         Carrega e processa os dados do DataFrame `df_total` fornecido na inicialização.
         Este método realiza as seguintes etapas:
-        1.  Cria uma cópia do DataFrame original para evitar modificações indesejadas.
+        1.  Lê as colunas do DataFrame original sem copiá-lo nem modificá-lo.
         2.  Verifica se as colunas necessárias ('Date', 'Close', 'ticker') existem.
-        3.  Converte a coluna 'Date' para o formato datetime.
+        3.  Converte a coluna 'Date' para o formato datetime (se ainda não estiver) e 'ticker' para categórica.
         4.  Filtra o DataFrame para manter apenas os tickers relevantes (ativos do portfólio + benchmark).
         5.  Transforma o DataFrame do formato 'long' 
         6.  Verifica se todos os tickers esperados (ativos e benchmark) estão presentes após o pivot.
@@ -107,24 +352,36 @@ class PortfolioOptimizer:
                         se o benchmark ou algum dos tickers do portfólio não for encontrado nos dados,
                         ou se os DataFrames de preços ou retornos ficarem vazios após o processamento.
         """
-        print("Carregando e processando dados do DataFrame fornecido...")
-        df = self.df_total.copy() 
+        logger.info("Carregando e processando dados do DataFrame fornecido...")
+        # O df_total não é copiado: as colunas são lidas sem modificá-lo e só as linhas filtradas são materializadas.
+        df_total = self.df_total
 
         # Verificação das colunas obrigatórias
         required_cols = ['Date', 'Close', 'ticker']
-        if not all(col in df.columns for col in required_cols):
+        if not all(col in df_total.columns for col in required_cols):
             raise ValueError(f"O DataFrame `df_total` deve conter as colunas: {', '.join(required_cols)}")
 
-        # Conversão da coluna de data e filtragem por tickers relevantes
-        df['Date'] = pd.to_datetime(df['Date'])
+        # Conversão da coluna de data (get_data/prepare_data já entregam datetime; só converte se necessário)
+        dates = df_total['Date']
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, format='ISO8601')
+
+        # Filtragem por tickers relevantes sobre os códigos inteiros da coluna categórica:
+        # as categorias procuradas são localizadas uma vez e a comparação é feita entre inteiros.
+        tickers = df_total['ticker']
+        if not isinstance(tickers.dtype, pd.CategoricalDtype):
+            tickers = tickers.astype('category')
         relevant_tickers = self.tickers_list.copy() + [self.benchmark_ticker]
-        df = df[df['ticker'].isin(relevant_tickers)]
+        relevant_codes = tickers.cat.categories.get_indexer(relevant_tickers)
+        mask = np.isin(tickers.cat.codes.to_numpy(), relevant_codes[relevant_codes >= 0])
+        df = pd.DataFrame({'Date': dates[mask], 'ticker': tickers[mask], 'Close': df_total['Close'][mask]})
 
         if df.empty:
             raise ValueError("O DataFrame ficou vazio após filtrar pelos tickers fornecidos. Verifique os nomes dos tickers e se há dados para eles no `df_total`.")
 
-        # Pivotar o DataFrame para ter datas como índice e tickers como colunas de preços ('Close')
-        prices_wide = df.pivot(index='Date', columns='ticker', values='Close')
+        # Pivotar o DataFrame para ter datas como índice e tickers como colunas de preços ('Close').
+        # Os preços são mantidos em float32: metade da memória, com precisão de sobra para cotações diárias.
+        prices_wide = self.pivot_prices(df)
         
         # Verificar se o benchmark e os tickers do portfólio estão presentes
         if self.benchmark_ticker not in prices_wide.columns:
@@ -146,16 +403,26 @@ class PortfolioOptimizer:
         if returns_wide.empty:
             raise ValueError("O DataFrame de retornos (returns_wide) está vazio. Isso pode ocorrer se houver apenas um dia de dados nos preços ou se os preços forem constantes.")
 
-        # Separar os dados do benchmark e dos ativos do portfólio
-        self.benchmark_returns = returns_wide[self.benchmark_ticker]
-        self.returns_data = returns_wide[self.tickers_list]
-        self.prices_data = prices_wide[self.tickers_list]
-
-        # Imprimir um resumo dos dados carregados
-        print(f"Dados carregados com sucesso. Período analisado: {self.prices_data.index.min().strftime('%Y-%m-%d')} até {self.prices_data.index.max().strftime('%Y-%m-%d')}")
-        print(f"Total de dias de negociação no período: {len(self.prices_data)}")
-        print(f"Tickers incluídos no portfólio: {', '.join(self.tickers_list)}")
-        print(f"Benchmark utilizado: {self.benchmark_ticker}")
+        # Separar os dados do benchmark e dos ativos do portfólio em arrays contíguos (uma única cópia)
+        self.benchmark_array = returns_wide[self.benchmark_ticker].to_numpy(dtype=np.float32, copy=True)
+        self.returns_array = np.ascontiguousarray(returns_wide[self.tickers_list].to_numpy(dtype=np.float32, copy=True))
+        self.prices_array = np.ascontiguousarray(prices_wide[self.tickers_list].to_numpy(dtype=np.float32, copy=True))
+        self.returns_dates = returns_wide.index
+        self.returns_dates_ns = returns_wide.index.to_numpy().astype('datetime64[ns]').view(np.int64)
+        self.prices_dates = prices_wide.index
+
+        # Estatísticas anualizadas (252 dias de negociação) calculadas uma única vez: são as mesmas
+        # em todas as chamadas de calculate_portfolio_performance (ex: a cada iteração do otimizador).
+        self.mean_returns_annual = self.returns_data.mean().to_numpy(dtype=np.float64) * 252
+        self.cov_matrix_annual = np.ascontiguousarray(self.returns_data.cov().to_numpy(dtype=np.float64) * 252)
+        self.cov_cholesky = cholesky_or_none(self.cov_matrix_annual)
+
+        # Registrar um resumo dos dados carregados (formatado só se o nível INFO estiver ativo)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"Dados carregados com sucesso. Período analisado: {self.prices_dates.min().strftime('%Y-%m-%d')} até {self.prices_dates.max().strftime('%Y-%m-%d')}")
+            logger.info(f"Total de dias de negociação no período: {len(self.prices_dates)}")
+            logger.info(f"Tickers incluídos no portfólio: {', '.join(self.tickers_list)}")
+            logger.info(f"Benchmark utilizado: {self.benchmark_ticker}")
 
     def calculate_portfolio_performance(self, weights):
         """
@@ -172,19 +439,17 @@ class PortfolioOptimizer:
                 - portfolio_volatility (float): A volatilidade anualizada do portfólio.
                 - sharpe_ratio (float): O Índice de Sharpe anualizado do portfólio.
         """
-        weights = np.array(weights) # Garante que os pesos sejam um array numpy
+        weights = np.asarray(weights, dtype=np.float64) # Garante que os pesos sejam um array numpy
 
         # Retorno esperado do portfólio:
-        # É a soma ponderada dos retornos médios históricos de cada ativo.
-        # Multiplicamos por 252 para anualizar (considerando 252 dias de negociação no ano).
-        portfolio_return = np.sum(self.returns_data.mean() * weights) * 252
+        # É a soma ponderada dos retornos médios históricos de cada ativo, já anualizados em load_data
+        # (multiplicados por 252, considerando 252 dias de negociação no ano).
+        portfolio_return = float(self.mean_returns_annual @ weights)
 
         # Risco (volatilidade) do portfólio:
-        # Calculado usando a matriz de covariância dos retornos dos ativos.
+        # Calculado usando a matriz de covariância anualizada dos retornos dos ativos (também de load_data).
         # Volatilidade = sqrt(pesos_transpostos * matriz_covariancia * pesos)
-        # A matriz de covariância também é anualizada multiplicando por 252.
-        cov_matrix_annualized = self.returns_data.cov() * 252
-        portfolio_volatility = np.sqrt(np.dot(weights.T, np.dot(cov_matrix_annualized, weights)))
+        portfolio_volatility = float(np.sqrt(weights @ self.cov_matrix_annual @ weights))
 
         # Índice de Sharpe:
         # Mede o retorno do portfólio em excesso à taxa livre de risco, por unidade de risco (volatilidade).
@@ -195,6 +460,114 @@ class PortfolioOptimizer:
         
         return portfolio_return, portfolio_volatility, sharpe_ratio
 
+    def make_sharpe_objective(self):
+        """
+        Cria a função objetivo para maximizar o Índice de Sharpe com `scipy.optimize.minimize`.
+
+        A função devolve o Sharpe negativo e o seu gradiente analítico juntos, para uso com
+        `minimize(objective, x0, jac=True, ...)`. Retornos médios, covariância e o fator de Cholesky
+        vêm de load_data, então cada iteração do otimizador custa só alguns produtos de matriz por vetor.
+
+        Returns:
+            callable: Função `objective(weights) -> (-sharpe, gradiente)`.
+        """
+        return sharpe_objective(self.mean_returns_annual, self.cov_matrix_annual, self.cov_cholesky, self.risk_free_rate)
+
+    def optimize_markowitz(self):
+        """
+        Otimização de Markowitz: encontra os pesos que maximizam o Índice de Sharpe do portfólio no período
+        completo, sem venda a descoberto (cada peso entre 0 e 1) e com a soma dos pesos igual a 1.
+
+        Returns:
+            dict or None: Um dicionário com os resultados da otimização (método, pesos, retorno, volatilidade,
+                          sharpe_ratio) se bem-sucedida. Retorna None se o otimizador não convergir.
+        """
+        logger.info("--- Otimizando Portfólio com Markowitz (Máximo Índice de Sharpe) ---")
+        num_assets = len(self.tickers_list)
+        bounds = [(0.0, 1.0)] * num_assets
+        constraints = {'type': 'eq', 'fun': lambda weights: np.sum(weights) - 1.0}
+        initial_weights = np.full(num_assets, 1.0 / num_assets) # Parte da alocação igualitária
+
+        # Sharpe negativo e seu gradiente analítico juntos (ver make_sharpe_objective)
+        result = minimize(self.make_sharpe_objective(), initial_weights, jac=True, method='SLSQP',
+                          bounds=bounds, constraints=constraints)
+        if not result.success:
+            logger.warning(f"Aviso: a otimização de Markowitz não convergiu ({result.message}).")
+            return None
+
+        # Remove resíduos numéricos (pesos levemente negativos) e renormaliza
+        weight_array = np.clip(result.x, 0.0, None)
+        weight_array /= weight_array.sum()
+        weights_dict = dict(zip(self.tickers_list, weight_array.tolist()))
+        portfolio_return, portfolio_volatility, sharpe_ratio = self.calculate_portfolio_performance(weight_array)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Otimização de Markowitz concluída!")
+            logger.info(f"  Retorno Esperado Anual do Portfólio: {portfolio_return:.4f}")
+            logger.info(f"  Volatilidade Anual do Portfólio: {portfolio_volatility:.4f}")
+            logger.info(f"  Índice de Sharpe Anualizado: {sharpe_ratio:.4f}")
+            logger.info("  Pesos Ótimos:")
+            for ticker, weight in weights_dict.items():
+                logger.info(f"    {ticker}: {weight:.4f}")
+
+        return {
+            'method': 'Markowitz',
+            'weights': weights_dict,
+            'returns': portfolio_return,
+            'volatility': portfolio_volatility,
+            'sharpe_ratio': sharpe_ratio
+        }
+
+    def rolling_optimize(self, window=252, rebalance_every=21):
+        """
+        Otimização de Markowitz (máximo Índice de Sharpe, sem venda a descoberto) em janelas deslizantes
+        (walk-forward): a cada `rebalance_every` dias, os pesos são otimizados com os retornos dos
+        últimos `window` dias.
+
+        Janelas consecutivas compartilham quase todos os dias, então média e covariância são mantidas
+        de forma incremental (`_RollingMoments`) em vez de recalculadas a cada rebalanceamento, e cada
+        otimização parte dos pesos da anterior.
+
+        Args:
+            window (int, optional): Número de dias de retornos usados em cada otimização. Padrão é 252 (1 ano).
+            rebalance_every (int, optional): Dias entre rebalanceamentos. Padrão é 21 (1 mês).
+
+        Returns:
+            pd.DataFrame: Pesos otimizados (colunas = tickers), indexados pelo último dia de cada janela.
+                          Vazio se não houver dias suficientes para uma janela.
+        """
+        logger.info(f"--- Otimização em Janelas Deslizantes (janela de {window} dias, rebalanceamento a cada {rebalance_every}) ---")
+        if self.returns_array is None or len(self.returns_array) < window:
+            logger.warning("Dados de retorno insuficientes para uma janela de otimização.")
+            return pd.DataFrame(columns=self.tickers_list)
+
+        moments = _RollingMoments(self.returns_array, window)
+        num_assets = len(self.tickers_list)
+        bounds = [(0.0, 1.0)] * num_assets
+        constraints = {'type': 'eq', 'fun': lambda weights: np.sum(weights) - 1.0}
+        weights = np.full(num_assets, 1.0 / num_assets)
+
+        dates, weights_history = [], []
+        while True:
+            # Estatísticas da janela, anualizadas (252 dias de negociação)
+            cov_matrix = moments.cov() * 252
+            objective = sharpe_objective(moments.mean() * 252, cov_matrix, cholesky_or_none(cov_matrix), self.risk_free_rate)
+            result = minimize(objective, weights, jac=True, method='SLSQP', bounds=bounds, constraints=constraints)
+            if result.success:
+                weights = result.x
+            else:
+                logger.warning(f"  Aviso: otimização não convergiu em {self.returns_dates[moments.end - 1]:%Y-%m-%d} ({result.message}). Mantendo os pesos anteriores.")
+            dates.append(self.returns_dates[moments.end - 1])
+            weights_history.append(weights)
+
+            if moments.end + rebalance_every > len(self.returns_array):
+                break
+            for _ in range(rebalance_every):
+                moments.advance()
+
+        logger.info(f"  {len(dates)} rebalanceamentos otimizados.")
+        return pd.DataFrame(np.array(weights_history), index=pd.DatetimeIndex(dates), columns=self.tickers_list)
+
     
     def prepare_ml_features(self, window_size=30,target_window=10):
         """
@@ -223,77 +596,135 @@ class PortfolioOptimizer:
                                        com os retornos futuros (targets) para cada ativo.
                                        Retorna DataFrames vazios ou dicionários vazios se não houver dados suficientes.
         """
-        print("\n--- Preparando Features para Modelos de Machine Learning ---")
+        logger.info("--- Preparando Features para Modelos de Machine Learning ---")
         
         # Verifica se há dados de retorno suficientes para criar features
-        if self.returns_data is None or self.returns_data.empty:
-            print("Dados de retorno não disponíveis. Não é possível preparar features para ML.")
+        if self.returns_array is None or self.returns_array.size == 0:
+            logger.warning("Dados de retorno não disponíveis. Não é possível preparar features para ML.")
             return pd.DataFrame(), {}
-        if len(self.returns_data) < 90 + window_size + 30: # Estimativa mínima para janelas e target futuro
-            print(f"Dados de retorno insuficientes ({len(self.returns_data)} dias) para criar features e targets com as janelas especificadas. São necessários mais dias de histórico.")
+        if len(self.returns_array) < 90 + window_size + 30: # Estimativa mínima para janelas e target futuro
+            logger.warning(f"Dados de retorno insuficientes ({len(self.returns_array)} dias) para criar features e targets com as janelas especificadas. São necessários mais dias de histórico.")
             return pd.DataFrame(), {}
 
-        features_df = pd.DataFrame(index=self.returns_data.index)
-
-        # Criação de features para cada ativo no portfólio
-        for ticker in self.tickers_list:
-            # Retornos acumulados (soma dos retornos) em diferentes janelas
-            for window in [5, 10, 20, window_size]:
-                features_df[f'{ticker}_return_{window}d'] = self.returns_data[ticker].rolling(window=window).sum()
-            # Volatilidade (desvio padrão dos retornos) em diferentes janelas
-            for window in [10, 20, window_size]:
-                features_df[f'{ticker}_vol_{window}d'] = self.returns_data[ticker].rolling(window=window).std()
-            # Momentum (retorno acumulado em uma janela mais longa, ex: 90 dias)
-            features_df[f'{ticker}_momentum_90d'] = self.returns_data[ticker].rolling(window=90).sum()
+        # As janelas são acumuladas em float64 (os dados ficam em float32)
+        returns_np = self.returns_array.astype(np.float64)
+
+        has_benchmark = self.benchmark_array is not None and self.benchmark_array.size > 0
+        if not has_benchmark:
+            logger.warning("Aviso: Dados de retorno do benchmark não disponíveis. Features de mercado não serão criadas.")
+
+        # Features de cada ativo, na ordem das colunas: retornos acumulados (soma dos retornos) em
+        # diferentes janelas, volatilidade (desvio padrão dos retornos) em diferentes janelas e
+        # momentum (retorno acumulado em uma janela mais longa, ex: 90 dias).
+        # dict.fromkeys remove janelas repetidas quando window_size coincide com uma das janelas fixas
+        return_windows = list(dict.fromkeys([5, 10, 20, window_size]))
+        vol_windows = list(dict.fromkeys([10, 20, window_size]))
+        feature_specs = ([(f'return_{window}d', window, False) for window in return_windows]
+                         + [(f'vol_{window}d', window, True) for window in vol_windows]
+                         + [('momentum_90d', 90, False)])
+        windows = np.array([window for _, window, _ in feature_specs], dtype=np.int64)
+        is_vol = np.array([vol for _, _, vol in feature_specs], dtype=np.bool_)
+        n_asset_features = len(self.tickers_list) * len(feature_specs)
+        n_features = n_asset_features + (2 if has_benchmark else 0)
+
+        # As primeiras linhas (até a maior janela) seriam NaN; a matriz de features é alocada
+        # uma única vez já sem elas e preenchida pelo kernel compilado.
+        first_row = max([90, window_size] + ([30] if has_benchmark else [])) - 1
+        features = np.empty((len(returns_np) - first_row, n_features), dtype=np.float64)
+        build_features(returns_np, windows, is_vol, first_row, features[:, :n_asset_features])
+        columns = [f'{ticker}_{name}' for ticker in self.tickers_list for name, _, _ in feature_specs]
 
         # Adicionar features do benchmark
-        if self.benchmark_returns is not None and not self.benchmark_returns.empty:
-            features_df['market_return_30d'] = self.benchmark_returns.rolling(window=30).sum()
-            features_df['market_vol_30d'] = self.benchmark_returns.rolling(window=30).std()
-        else:
-            print("Aviso: Dados de retorno do benchmark não disponíveis. Features de mercado não serão criadas.")
+        if has_benchmark:
+            benchmark_np = self.benchmark_array.astype(np.float64).reshape(-1, 1)
+            build_features(benchmark_np, np.array([30, 30], dtype=np.int64), np.array([False, True]),
+                           first_row, features[:, n_asset_features:])
+            columns += ['market_return_30d', 'market_vol_30d']
 
-        # Remover linhas com valores NaN (gerados pelo rolling window no início da série)
-        features_df = features_df.dropna()
+        features_df = pd.DataFrame(features, index=self.returns_dates[first_row:], columns=columns, copy=False)
 
         if features_df.empty:
-            print("DataFrame de features ficou vazio após remover NaNs. Verifique o tamanho do histórico e as janelas.")
+            logger.warning("DataFrame de features ficou vazio após descartar o início das janelas. Verifique o tamanho do histórico e as janelas.")
             return pd.DataFrame(), {}
 
-        # Criação dos targets: retorno futuro de 30 dias para cada ativo
-        targets_dict = {}
-        for ticker in self.tickers_list:
-            # O target é o retorno acumulado nos próximos 30 dias.
-            # Usamos .shift(-30) para trazer os retornos futuros para a linha atual.
-            future_returns = self.returns_data[ticker].rolling(window=target_window).sum().shift(-target_window)
-            targets_dict[ticker] = future_returns.loc[features_df.index] # Alinha os targets com o índice das features
-        
-        # Concatenar targets para remover NaNs de forma consistente
-        # Se algum target for NaN para uma data, essa data é removida das features e de todos os targets.
-        target_df_combined = pd.concat(targets_dict, axis=1)
-        valid_indices = ~target_df_combined.isna().any(axis=1)
-        
-        features_df = features_df.loc[valid_indices]
-        targets_dict = {ticker: target_series.loc[valid_indices] for ticker, target_series in targets_dict.items()}
+        # Criação dos targets: retorno acumulado nos `target_window` dias seguintes a cada data, para todos
+        # os ativos de uma vez. Com a soma acumulada cs (cs[j] = soma dos retornos até a linha j, exclusive),
+        # o retorno futuro da linha t é cs[t + 1 + target_window] - cs[t + 1].
+        cumsum = np.zeros((len(returns_np) + 1, returns_np.shape[1]), dtype=np.float64)
+        np.cumsum(returns_np, axis=0, out=cumsum[1:])
+        future_returns = cumsum[1 + target_window:] - cumsum[1:-target_window]
+
+        # Só há target para as datas com `target_window` dias à frente; as últimas linhas das features são descartadas.
+        n_valid = len(future_returns) - first_row
+        features_df = features_df.iloc[:max(n_valid, 0)]
+        targets = future_returns[first_row:first_row + len(features_df)]
+        targets_dict = {ticker: pd.Series(targets[:, i], index=features_df.index, name=ticker)
+                        for i, ticker in enumerate(self.tickers_list)}
 
         if features_df.empty:
-            print("DataFrame de features ficou vazio após alinhar com targets válidos. Pode não haver sobreposição suficiente entre features e targets futuros.")
+            logger.warning("DataFrame de features ficou vazio após alinhar com targets válidos. Pode não haver sobreposição suficiente entre features e targets futuros.")
             return pd.DataFrame(), {}
             
-        print(f"Features e targets preparados. Shape das features: {features_df.shape}. Número de targets: {len(targets_dict)}.")
+        logger.info(f"Features e targets preparados. Shape das features: {features_df.shape}. Número de targets: {len(targets_dict)}.")
         return features_df, targets_dict
 
-    
-    def read_joblib(self):
+    def train_ml_models(self, features_df, targets_dict, test_size=0.2):
+        """
+        Treina um Random Forest por ativo para prever o retorno futuro (targets de `prepare_ml_features`),
+        com os mesmos hiperparâmetros usados no notebook de treinamento (2_ML_treinamento_modelos_portfolio).
+
+        A divisão treino/teste é temporal (sem embaralhar): o teste é o trecho final do período.
+
+        Args:
+            features_df (pd.DataFrame): Features de `prepare_ml_features`.
+            targets_dict (dict): Targets por ticker de `prepare_ml_features`.
+            test_size (float, optional): Fração final dos dados reservada para teste. Padrão é 0.2.
+
+        Returns:
+            tuple: (dicionário {ticker: modelo treinado}, dicionário {ticker: {'mse', 'r2', 'oob_score'}}).
+                   Ambos vazios se não houver features ou targets.
+        """
+        logger.info("--- Treinando Modelos de Machine Learning ---")
         models_dict = {}
-        
-        for filename in os.listdir('models/trained_models'):
-            if filename.endswith('.joblib'):
-                model_name = os.path.splitext(filename)[0].replace("ml_model_", "")
-                model_path = os.path.join('models/trained_models', filename)
-                models_dict[model_name] = joblib.load(model_path)
+        performance_dict = {}
+        if features_df.empty or not targets_dict:
+            logger.warning("Features ou targets não disponíveis. Nenhum modelo de ML foi treinado.")
+            return models_dict, performance_dict
+
+        for ticker in self.tickers_list:
+            if ticker not in targets_dict:
+                logger.warning(f"  Target não disponível para {ticker}. Modelo não treinado.")
+                continue
+
+            X_train, X_test, y_train, y_test = train_test_split(features_df, targets_dict[ticker],
+                                                                test_size=test_size, shuffle=False)
+            model = RandomForestRegressor(n_estimators=300, max_depth=5, min_samples_leaf=10, max_features='sqrt',
+                                          bootstrap=True, max_samples=0.8, oob_score=True, random_state=42, n_jobs=-1)
+            model.fit(X_train, y_train)
+
+            y_pred = model.predict(X_test)
+            mse = mean_squared_error(y_test, y_pred)
+            r2 = r2_score(y_test, y_pred)
+            logger.info(f"  {ticker}: MSE: {mse:.6f} | R²: {r2:.4f} | OOB: {model.oob_score_:.4f}")
+
+            models_dict[ticker] = model
+            performance_dict[ticker] = {'mse': mse, 'r2': r2, 'oob_score': model.oob_score_}
+
+        return models_dict, performance_dict
 
-        return models_dict
+    @staticmethod
+    def read_joblib():
+        # Import local: models.modelos_onnx importa MODELS_DIR deste módulo
+        from models.modelos_onnx import carregar_modelo
+
+        filenames = [filename for filename in os.listdir(MODELS_DIR) if filename.endswith('.joblib')]
+
+        # Usa a versão ONNX compilada de cada floresta quando disponível (predição em código nativo).
+        # Os arquivos são lidos em paralelo (threads): a leitura do disco e dos arrays das árvores libera o GIL
+        models = Parallel(n_jobs=-1, prefer='threads')(
+            delayed(carregar_modelo)(os.path.join(MODELS_DIR, filename)) for filename in filenames
+        )
+        return {os.path.splitext(filename)[0].replace("ml_model_", ""): model for filename, model in zip(filenames, models)}
        
 
     def optimize_ml_portfolio(self, models_dict, features_df):
@@ -311,60 +742,60 @@ class PortfolioOptimizer:
                           retorno, volatilidade, sharpe_ratio, previsões) se bem-sucedida.
                           Retorna None se não for possível otimizar (ex: sem modelos ou features).
         """
-        print("\n--- Otimizando Portfólio com Base em Previsões de Machine Learning ---")
+        logger.info("--- Otimizando Portfólio com Base em Previsões de Machine Learning ---")
         if not models_dict or features_df.empty:
-            print("Nenhum modelo de ML treinado ou features não disponíveis. Não é possível otimizar com ML.")
+            logger.warning("Nenhum modelo de ML treinado ou features não disponíveis. Não é possível otimizar com ML.")
             return None
         
         # Usar as features mais recentes para fazer as previsões de retorno para o próximo período.
-        latest_features = features_df.iloc[-1:].copy()
+        # A linha é convertida uma única vez para um array float32 contíguo (tipo usado internamente pelas
+        # árvores) e o mesmo DataFrame, sem cópia, é entregue a todos os modelos: nenhum precisa copiar/converter a entrada.
+        latest_features = pd.DataFrame(np.ascontiguousarray(features_df.iloc[-1:].to_numpy(dtype=np.float32)),
+                                       index=features_df.index[-1:], columns=features_df.columns, copy=False)
         
-        predicted_returns = {}
-        for ticker in self.tickers_list:
-            if ticker in models_dict:
-                predicted_returns[ticker] = models_dict[ticker].predict(latest_features)[0]
-            else:
-                # Se algum modelo não foi treinado (ex: por falta de dados), assume previsão de retorno zero.
-                predicted_returns[ticker] = 0
-        print(f"  Retornos previstos para o próximo período: {predicted_returns}")
+        # Uma predição de uma linha por ticker, em sequência: cada uma leva dezenas de microssegundos (ONNX),
+        # menos que o custo de criar um pool de threads a cada requisição (e sem disputar CPU com os
+        # threads do servidor da API).
+        tickers_with_model = [ticker for ticker in self.tickers_list if ticker in models_dict]
+        predictions = [models_dict[ticker].predict(latest_features) for ticker in tickers_with_model]
+
+        # Previsões na ordem de tickers_list. Se algum modelo não foi treinado (ex: por falta de dados),
+        # assume previsão de retorno zero.
+        num_assets = len(self.tickers_list)
+        predicted_array = np.zeros(num_assets, dtype=np.float64)
+        if predictions:
+            predicted_array[[self.ticker_index[ticker] for ticker in tickers_with_model]] = np.column_stack(predictions)[0]
+        # O dicionário só é montado para exibição e para o resultado
+        predicted_returns = dict(zip(self.tickers_list, predicted_array.tolist()))
+        logger.info(f"  Retornos previstos para o próximo período: {predicted_returns}")
 
         # Alocação de pesos baseada nas previsões:
-        # Considera apenas os retornos previstos positivos.
-        positive_predicted_returns = {ticker: ret for ticker, ret in predicted_returns.items() if ret > 0}
-        total_positive_sum = sum(positive_predicted_returns.values())
-        num_assets = len(self.tickers_list)
+        # Considera apenas os retornos previstos positivos (os negativos viram zero) e aloca os pesos
+        # proporcionalmente a eles; a divisão pela soma já garante que os pesos somem 1.
+        positive_predicted_returns = np.clip(predicted_array, 0.0, None)
+        total_positive_sum = positive_predicted_returns.sum()
 
-        weights_dict = {}
         if total_positive_sum > 0:
-            # Aloca pesos proporcionalmente aos retornos previstos positivos.
-            for ticker in self.tickers_list:
-                weights_dict[ticker] = positive_predicted_returns.get(ticker, 0) / total_positive_sum
+            weight_array = positive_predicted_returns / total_positive_sum
         else:
             # Se todos os retornos previstos são negativos ou zero, aloca igualmente (ou poderia ser caixa).
-            print("  Todos os retornos previstos são negativos ou zero. Alocando pesos igualmente.")
-            for ticker in self.tickers_list:
-                weights_dict[ticker] = 1.0 / num_assets if num_assets > 0 else 0
-        
-        # Converter o dicionário de pesos para um array numpy para cálculo de performance.
-        weight_array = np.array([weights_dict.get(ticker, 0) for ticker in self.tickers_list])
-        
-        # Normalização final para garantir que a soma dos pesos seja 1 (devido a arredondamentos ou lógica).
-        if not np.isclose(np.sum(weight_array), 1.0) and np.sum(weight_array) > 0:
-            weight_array = weight_array / np.sum(weight_array)
-            weights_dict = {ticker: weight_array[i] for i, ticker in enumerate(self.tickers_list)}
+            logger.warning("  Todos os retornos previstos são negativos ou zero. Alocando pesos igualmente.")
+            weight_array = np.full(num_assets, 1.0 / num_assets) if num_assets > 0 else np.zeros(0)
+        weights_dict = dict(zip(self.tickers_list, weight_array.tolist()))
 
         # Calcular as métricas de desempenho do portfólio com os pesos definidos pelo ML.
         # Nota: O retorno e volatilidade aqui são baseados em dados históricos, usando os pesos do ML.
         # O 'retorno' previsto pelo ML é usado para definir os pesos, não para o cálculo direto de performance histórica.
         portfolio_return, portfolio_volatility, sharpe_ratio = self.calculate_portfolio_performance(weight_array)
         
-        print("Otimização com ML concluída!")
-        print(f"  Retorno Esperado Anual do Portfólio (histórico com pesos ML): {portfolio_return:.4f}")
-        print(f"  Volatilidade Anual do Portfólio (histórico com pesos ML): {portfolio_volatility:.4f}")
-        print(f"  Índice de Sharpe Anualizado (histórico com pesos ML): {sharpe_ratio:.4f}")
-        print("  Pesos Ótimos (baseados em ML):")
-        for ticker, weight in weights_dict.items():
-            print(f"    {ticker}: {weight:.4f}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Otimização com ML concluída!")
+            logger.info(f"  Retorno Esperado Anual do Portfólio (histórico com pesos ML): {portfolio_return:.4f}")
+            logger.info(f"  Volatilidade Anual do Portfólio (histórico com pesos ML): {portfolio_volatility:.4f}")
+            logger.info(f"  Índice de Sharpe Anualizado (histórico com pesos ML): {sharpe_ratio:.4f}")
+            logger.info("  Pesos Ótimos (baseados em ML):")
+            for ticker, weight in weights_dict.items():
+                logger.info(f"    {ticker}: {weight:.4f}")
 
         return {
             'method': 'Machine Learning',
@@ -375,7 +806,49 @@ class PortfolioOptimizer:
             'predicted_returns_for_allocation': predicted_returns # Retornos que o ML previu para definir os pesos
         }
 
-    def backtest_portfolio(self, weights_input, start_date_str=None, end_date_str=None):
+    def date_positions(self, start_date_str=None, end_date_str=None):
+        """
+        Posições (início, fim exclusivo) do período [start_date_str, end_date_str] no array de retornos,
+        por busca binária sobre as datas em int64 (O(log dias)). None = sem limite naquele lado.
+        """
+        dates_ns = self.returns_dates_ns
+        start_pos = int(np.searchsorted(dates_ns, pd.Timestamp(start_date_str).as_unit('ns').value, side='left')) if start_date_str else 0
+        end_pos = int(np.searchsorted(dates_ns, pd.Timestamp(end_date_str).as_unit('ns').value, side='right')) if end_date_str else len(dates_ns)
+        return start_pos, end_pos
+
+    def weights_to_array(self, weights_input, verbose=False):
+        """
+        Converte pesos para um array float64 na ordem de `self.tickers_list`.
+
+        Args:
+            weights_input (dict or list or np.array): Dicionário {ticker: peso} (tickers fora do portfólio são
+                                                      ignorados e a soma é normalizada para 1) ou pesos já na ordem.
+            verbose (bool, optional): Se True, avisa quando os pesos do dicionário são normalizados.
+
+        Raises:
+            ValueError: Se o formato for inválido ou o número de pesos não corresponder ao de tickers.
+        """
+        num_assets = len(self.tickers_list)
+        if isinstance(weights_input, dict):
+            weight_array = np.zeros(num_assets, dtype=np.float64)
+            known = [ticker for ticker in weights_input if ticker in self.ticker_index]
+            weight_array[[self.ticker_index[ticker] for ticker in known]] = [weights_input[ticker] for ticker in known]
+            # Normaliza se a soma não for 1 (ex: se algum ticker do dict não estava em self.tickers_list)
+            total = weight_array.sum()
+            if not np.isclose(total, 1.0) and total > 0:
+                if verbose:
+                    logger.warning("Aviso: Soma dos pesos do dicionário não é 1. Normalizando para o backtest.")
+                weight_array /= total
+        elif isinstance(weights_input, (list, np.ndarray)):
+            weight_array = np.asarray(weights_input, dtype=np.float64)
+        else:
+            raise ValueError("Formato de pesos inválido para backtesting. Deve ser dict ou array/list.")
+
+        if len(weight_array) != num_assets:
+            raise ValueError(f"Número de pesos ({len(weight_array)}) não corresponde ao número de tickers ({num_assets}) no portfólio.")
+        return weight_array
+
+    def backtest_portfolio(self, weights_input, start_date_str=None, end_date_str=None, plot=False):
         """
         Realiza o backtesting de um portfólio com uma dada alocação de pesos.
         Calcula o desempenho histórico do portfólio e o compara com o benchmark.
@@ -387,122 +860,187 @@ class PortfolioOptimizer:
                                             Se None, usa o início dos dados de retorno disponíveis.
             end_date_str (str, optional): Data de fim para o período de backtest (formato 'YYYY-MM-DD').
                                           Se None, usa o fim dos dados de retorno disponíveis.
+            plot (bool, optional): Se True, exibe o gráfico dos retornos acumulados (ver `plot_backtest`).
+                                   Padrão é False, para não pagar o custo do matplotlib em execuções em lote.
 
         Returns:
             dict or None: Um dicionário contendo as métricas e séries temporais do backtest
                           (retornos acumulados, retorno total, anualizado, volatilidade, sharpe, drawdown).
                           Retorna None se o backtest não puder ser realizado.
         """
-        print(f"\n--- Realizando Backtesting do Portfólio ---")
-        
-        if self.returns_data is None or self.returns_data.empty:
-            print("Dados de retorno não disponíveis. Backtesting não pode ser realizado.")
-            return None
+        results = self.backtest_portfolios({'portfolio': weights_input}, start_date_str, end_date_str, plot)
+        return results['portfolio']
 
-        # Copiar dados para evitar modificar os originais da classe
-        returns_data_filtered = self.returns_data.copy()
-        benchmark_returns_filtered = self.benchmark_returns.copy()
-
-        # Filtrar os dados de retorno pelo período de backtest especificado
-        if start_date_str:
-            start_date = pd.to_datetime(start_date_str)
-            returns_data_filtered = returns_data_filtered.loc[returns_data_filtered.index >= start_date]
-            benchmark_returns_filtered = benchmark_returns_filtered.loc[benchmark_returns_filtered.index >= start_date]
-        if end_date_str:
-            end_date = pd.to_datetime(end_date_str)
-            returns_data_filtered = returns_data_filtered.loc[returns_data_filtered.index <= end_date]
-            benchmark_returns_filtered = benchmark_returns_filtered.loc[benchmark_returns_filtered.index <= end_date]
-
-        if returns_data_filtered.empty:
-            print("Não há dados de retorno para o período de backtest especificado.")
-            return None
+    def backtest_portfolios(self, weights_by_strategy, start_date_str=None, end_date_str=None, plot=False):
+        """
+        Realiza o backtesting de várias estratégias no mesmo período, em uma única passada: o período
+        é localizado uma vez, os retornos diários de todas as estratégias saem de um único produto
+        matriz-matriz (a matriz de retornos é lida uma vez) e o benchmark é calculado uma vez.
 
-        # Converter/validar os pesos para formato de array numpy
-        if isinstance(weights_input, dict):
-            # Garante que os pesos estejam na mesma ordem que self.tickers_list
-            weight_array = np.array([weights_input.get(ticker, 0) for ticker in self.tickers_list])
-            # Normaliza se a soma não for 1 (ex: se algum ticker do dict não estava em self.tickers_list)
-            if not np.isclose(np.sum(weight_array), 1.0) and np.sum(weight_array) > 0:
-                print("Aviso: Soma dos pesos do dicionário não é 1. Normalizando para o backtest.")
-                weight_array = weight_array / np.sum(weight_array)
-        elif isinstance(weights_input, (list, np.ndarray)):
-            weight_array = np.array(weights_input)
-        else:
-            print("Formato de pesos inválido para backtesting. Deve ser dict ou array/list.")
-            return None
-        
-        if len(weight_array) != len(self.tickers_list):
-            print(f"Erro: Número de pesos ({len(weight_array)}) não corresponde ao número de tickers ({len(self.tickers_list)}) no portfólio.")
-            return None
+        Args:
+            weights_by_strategy (dict): Dicionário {nome da estratégia: pesos}, com os pesos no mesmo
+                                        formato de `backtest_portfolio`.
+            start_date_str, end_date_str, plot: Como em `backtest_portfolio`.
 
-        # Calcular os retornos diários do portfólio no período de backtest
-        # Isso é feito multiplicando os retornos diários de cada ativo pelo seu peso no portfólio e somando.
-        portfolio_daily_returns = returns_data_filtered.dot(weight_array)
-        
-        # Calcular os retornos acumulados do portfólio
-        # (1 + r1) * (1 + r2) * ... * (1 + rn)
-        cumulative_portfolio_returns = (1 + portfolio_daily_returns).cumprod()
+        Returns:
+            dict: {nome da estratégia: resultado de `backtest_portfolio`}. O resultado é None para as
+                  estratégias com pesos inválidos (ou para todas, se não houver dados no período).
+        """
+        logger.info(f"--- Realizando Backtesting do Portfólio ---")
+        results = dict.fromkeys(weights_by_strategy)
+
+        if self.returns_array is None or self.returns_array.size == 0:
+            logger.warning("Dados de retorno não disponíveis. Backtesting não pode ser realizado.")
+            return results
+
+        # Filtrar o período de backtest por posição: o índice de datas é ordenado, então os limites
+        # são encontrados por busca binária e os dados são apenas fatiados (sem cópias)
+        start_pos, end_pos = self.date_positions(start_date_str, end_date_str)
+        backtest_dates = self.returns_dates[start_pos:end_pos]
+
+        if len(backtest_dates) == 0:
+            logger.warning("Não há dados de retorno para o período de backtest especificado.")
+            return results
+
+        # Converter/validar os pesos de cada estratégia para formato de array numpy
+        weight_arrays = {}
+        for name, weights_input in weights_by_strategy.items():
+            try:
+                weight_arrays[name] = self.weights_to_array(weights_input, verbose=True)
+            except ValueError as e:
+                logger.error(f"Erro: {e}")
+        if not weight_arrays:
+            return results
+
+        # Calcular os retornos diários das estratégias no período de backtest: cada coluna de
+        # `weight_matrix` é uma estratégia, então um único produto (dias x tickers) @ (tickers x estratégias)
+        # dá os retornos de todas (com pesos float64, o resultado é float64).
+        weight_matrix = np.column_stack(list(weight_arrays.values()))
+        strategy_daily_returns = self.returns_array[start_pos:end_pos] @ weight_matrix
+
+        # Calcular os retornos acumulados do benchmark para o mesmo período, uma vez para todas as
+        # estratégias. O benchmark vem do mesmo returns_wide que os ativos (mesmas datas, sem NaN),
+        # então basta fatiar pelas mesmas posições.
+        # (produto acumulado direto em numpy: medido mais rápido que exp(cumsum(log1p(r))), que troca
+        # multiplicações por logaritmos e exponenciais e não é exatamente igual)
+        benchmark_daily_returns = self.benchmark_array[start_pos:end_pos].astype(np.float64)
+        cumulative_benchmark_returns = pd.Series(np.cumprod(1.0 + benchmark_daily_returns),
+                                                 index=backtest_dates, name=self.benchmark_ticker)
+
+        actual_start_date = backtest_dates[0].strftime('%Y-%m-%d')
+        actual_end_date = backtest_dates[-1].strftime('%Y-%m-%d')
+
+        for column, name in enumerate(weight_arrays):
+            # Calcular os retornos acumulados do portfólio e as métricas de desempenho do backtest
+            portfolio_daily_returns = np.ascontiguousarray(strategy_daily_returns[:, column])
+            cumulative_portfolio_array = np.empty_like(portfolio_daily_returns)
+            metrics = backtest_metrics(portfolio_daily_returns, self.risk_free_rate, cumulative_portfolio_array)
+            cumulative_portfolio_returns = pd.Series(cumulative_portfolio_array, index=backtest_dates)
+
+            # Registrar resultados do backtest
+            if logger.isEnabledFor(logging.INFO):
+                if len(weights_by_strategy) > 1:
+                    logger.info(f"  Estratégia: {name}")
+                logger.info(f"  Período do Backtest: {actual_start_date} até {actual_end_date} ({metrics['num_days']} dias)")
+                logger.info(f"  Retorno Total do Portfólio: {metrics['total_return']:.4%}")
+                logger.info(f"  Retorno Anualizado do Portfólio: {metrics['annual_return']:.4%}")
+                logger.info(f"  Volatilidade Anualizada do Portfólio: {metrics['volatility']:.4%}")
+                logger.info(f"  Índice de Sharpe do Portfólio: {metrics['sharpe_ratio']:.4f}")
+                logger.info(f"  Máximo Drawdown do Portfólio: {metrics['max_drawdown']:.4%}")
+
+            results[name] = {
+                'cumulative_returns_portfolio': cumulative_portfolio_returns,
+                'cumulative_returns_benchmark': cumulative_benchmark_returns,
+                'total_return': metrics['total_return'],
+                'annual_return': metrics['annual_return'],
+                'volatility': metrics['volatility'],
+                'sharpe_ratio': metrics['sharpe_ratio'],
+                'max_drawdown': metrics['max_drawdown'],
+                'start_date': actual_start_date,
+                'end_date': actual_end_date,
+                'num_days': metrics['num_days']
+            }
 
-        # Alinhar e calcular os retornos acumulados do benchmark para o mesmo período
-        benchmark_returns_aligned = benchmark_returns_filtered.reindex(portfolio_daily_returns.index).fillna(0)
-        cumulative_benchmark_returns = (1 + benchmark_returns_aligned).cumprod()
+            if plot:
+                self.plot_backtest(results[name])
 
-        # Calcular métricas de desempenho do backtest
-        total_return_portfolio = cumulative_portfolio_returns.iloc[-1] - 1
-        num_days_backtest = len(cumulative_portfolio_returns)
-        
-        # Retorno anualizado: ( (1 + Retorno Total) ^ (252 / Número de Dias) ) - 1
-        annual_return_portfolio = (1 + total_return_portfolio) ** (252 / num_days_backtest) - 1 if num_days_backtest > 0 else 0.0
-        
-        # Volatilidade anualizada: Desvio padrão dos retornos diários * sqrt(252)
-        annual_volatility_portfolio = portfolio_daily_returns.std() * np.sqrt(252)
-        
-        # Índice de Sharpe anualizado
-        sharpe_ratio_portfolio = (annual_return_portfolio - self.risk_free_rate) / annual_volatility_portfolio if annual_volatility_portfolio != 0 else 0.0
-        
-        # Máximo Drawdown: Maior queda percentual do pico ao vale durante o período.
-        rolling_max_portfolio = cumulative_portfolio_returns.cummax()
-        drawdown_portfolio = (cumulative_portfolio_returns - rolling_max_portfolio) / rolling_max_portfolio
-        max_drawdown_portfolio = drawdown_portfolio.min() if not drawdown_portfolio.empty else 0.0
-
-        # Imprimir resultados do backtest
-        actual_start_date = returns_data_filtered.index.min().strftime('%Y-%m-%d')
-        actual_end_date = returns_data_filtered.index.max().strftime('%Y-%m-%d')
-        print(f"  Período do Backtest: {actual_start_date} até {actual_end_date} ({num_days_backtest} dias)")
-        print(f"  Retorno Total do Portfólio: {total_return_portfolio:.4%}")
-        print(f"  Retorno Anualizado do Portfólio: {annual_return_portfolio:.4%}")
-        print(f"  Volatilidade Anualizada do Portfólio: {annual_volatility_portfolio:.4%}")
-        print(f"  Índice de Sharpe do Portfólio: {sharpe_ratio_portfolio:.4f}")
-        print(f"  Máximo Drawdown do Portfólio: {max_drawdown_portfolio:.4%}")
-
-        backtest_results = {
-            'cumulative_returns_portfolio': cumulative_portfolio_returns,
-            'cumulative_returns_benchmark': cumulative_benchmark_returns,
-            'total_return': total_return_portfolio,
-            'annual_return': annual_return_portfolio,
-            'volatility': annual_volatility_portfolio,
-            'sharpe_ratio': sharpe_ratio_portfolio,
-            'max_drawdown': max_drawdown_portfolio,
-            'start_date': actual_start_date,
-            'end_date': actual_end_date,
-            'num_days': num_days_backtest
-        }
-        
-        # Plotar gráfico de retornos acumulados
-        plt.figure(figsize=(12, 6))
-        cumulative_portfolio_returns.plot(label='Portfólio Otimizado', legend=True)
-        cumulative_benchmark_returns.plot(label=f'Benchmark ({self.benchmark_ticker})', legend=True, linestyle='--')
-        plt.title(f'Desempenho Acumulado do Portfólio vs. Benchmark ({actual_start_date} a {actual_end_date})')
+        return results
+
+    def batch_backtest(self, weights_list, windows=None, n_jobs=None):
+        """
+        Executa muitos backtests (ex: varreduras de pesos, Monte Carlo, walk-forward) em paralelo,
+        em processos, calculando apenas as métricas escalares (sem séries, impressão ou gráfico).
+
+        A matriz de retornos é colocada uma única vez em memória compartilhada
+        (`multiprocessing.shared_memory`), então os processos não recebem uma cópia dela a cada tarefa.
+
+        Args:
+            weights_list (list): Lista de pesos (dict {ticker: peso} ou array na ordem de `self.tickers_list`).
+            windows (list, optional): Lista de períodos (start_date_str, end_date_str), no mesmo formato de
+                                      `backtest_portfolio` (None = sem limite). Cada conjunto de pesos é
+                                      testado em cada período. Padrão é o período completo.
+            n_jobs (int, optional): Número de processos. Padrão é o número de CPUs.
+
+        Returns:
+            pd.DataFrame: Uma linha por (pesos, período), com as colunas 'weights_index', 'start_date',
+                          'end_date' e as métricas de `backtest_metrics`. Períodos sem dados ficam com métricas NaN.
+        """
+        if windows is None:
+            windows = [(None, None)]
+        weight_arrays = [self.weights_to_array(weights_input) for weights_input in weights_list]
+
+        # Limites de cada período em posições do array de retornos (como em backtest_portfolio)
+        dates = self.returns_dates
+        positions = [self.date_positions(start_date_str, end_date_str) for start_date_str, end_date_str in windows]
+
+        tasks = [(weights_index, weight_array, start_pos, end_pos)
+                 for weights_index, weight_array in enumerate(weight_arrays)
+                 for start_pos, end_pos in positions]
+
+        shm = shared_memory.SharedMemory(create=True, size=self.returns_array.nbytes)
+        try:
+            np.ndarray(self.returns_array.shape, dtype=self.returns_array.dtype, buffer=shm.buf)[:] = self.returns_array
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_backtest_worker,
+                                     initargs=(shm.name, self.returns_array.shape, self.returns_array.dtype.str, self.risk_free_rate)) as executor:
+                metrics_list = list(executor.map(_run_backtest_task, tasks, chunksize=64))
+        finally:
+            shm.close()
+            shm.unlink()
+
+        rows = []
+        for (weights_index, _, start_pos, end_pos), metrics in zip(tasks, metrics_list):
+            has_data = end_pos > start_pos
+            rows.append({
+                'weights_index': weights_index,
+                'start_date': dates[start_pos].strftime('%Y-%m-%d') if has_data else None,
+                'end_date': dates[end_pos - 1].strftime('%Y-%m-%d') if has_data else None,
+                **metrics,
+            })
+        return pd.DataFrame(rows)
+
+    def plot_backtest(self, backtest_results):
+        """
+        Exibe o gráfico dos retornos acumulados do portfólio e do benchmark de um resultado de `backtest_portfolio`.
+        A figura é fechada depois de exibida, para não acumular memória em chamadas repetidas.
+        """
+        fig = plt.figure(figsize=(12, 6))
+        backtest_results['cumulative_returns_portfolio'].plot(label='Portfólio Otimizado', legend=True)
+        backtest_results['cumulative_returns_benchmark'].plot(label=f'Benchmark ({self.benchmark_ticker})', legend=True, linestyle='--')
+        plt.title(f"Desempenho Acumulado do Portfólio vs. Benchmark ({backtest_results['start_date']} a {backtest_results['end_date']})")
         plt.ylabel('Retorno Acumulado')
         plt.xlabel('Data')
         plt.grid(True)
         plt.show()
-
-        return backtest_results
+        plt.close(fig)
 
     def save_results(self, optimization_results_dict, backtest_results_dict, filename='portfolio_results.json'):
         """
-        Salva os resultados da otimização e do backtest em um arquivo JSON.
+        Salva os resultados da otimização e as métricas do backtest em um arquivo JSON e as séries de
+        retornos acumulados do backtest em um arquivo .npz ao lado dele (mesmo nome, extensão .npz).
+
+        O .npz (numpy comprimido) contém os arrays 'dates' (datas em int64, nanossegundos desde a época;
+        ler com `.view('datetime64[ns]')`), 'portfolio' e 'benchmark' (retornos acumulados em float32).
+        O JSON indica o nome desse arquivo em 'time_series_file'.
 
         Args:
             optimization_results_dict (dict): Dicionário com os resultados da fase de otimização.
@@ -511,44 +1049,162 @@ class PortfolioOptimizer:
                                       Padrão é 'portfolio_results.json'.
 
         Returns:
-            dict or None: O dicionário combinado que foi salvo em JSON, ou None se os resultados forem None.
+            dict or None: O dicionário que foi salvo em JSON, ou None se os resultados forem None.
         """
         if optimization_results_dict is None or backtest_results_dict is None:
-            print(f"Não há resultados de otimização ou backtest para salvar em {filename}.")
+            logger.warning(f"Não há resultados de otimização ou backtest para salvar em {filename}.")
             return None
-        
-        # Preparar os dados para serem serializáveis em JSON.
-        # Series do Pandas precisam ser convertidas para dicionários.
+
+        # As séries temporais vão em binário (arrays numpy comprimidos), bem menores e mais rápidas de
+        # escrever e de ler que um dicionário {data: valor} em JSON; o JSON fica só com os escalares.
+        portfolio_series = backtest_results_dict.get('cumulative_returns_portfolio')
+        benchmark_series = backtest_results_dict.get('cumulative_returns_benchmark')
+        time_series_filename = os.path.splitext(filename)[0] + '.npz'
+
         output_data = {
             'optimization_results': optimization_results_dict,
             'backtest_metrics': { # Apenas as métricas escalares do backtest
                 key: value for key, value in backtest_results_dict.items() 
                 if not isinstance(value, pd.Series)
             },
-            # Salvar as séries temporais de retornos acumulados como dicionários (data: valor)
-            # As chaves do dicionário (datas) são convertidas para string no formato ISO.
-            'cumulative_returns_portfolio_ts': {
-                idx.isoformat(): val for idx, val in backtest_results_dict.get('cumulative_returns_portfolio', pd.Series()).items()
-            },
-            'cumulative_returns_benchmark_ts': {
-                idx.isoformat(): val for idx, val in backtest_results_dict.get('cumulative_returns_benchmark', pd.Series()).items()
-            }
+            'time_series_file': os.path.basename(time_series_filename) if portfolio_series is not None else None
         }
-        
+
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(output_data, f, indent=4, ensure_ascii=False)
-            print(f"Resultados da otimização e backtest salvos com sucesso em: {filename}")
+            # orjson codifica escalares e arrays numpy diretamente em C (UTF-8, indentação de 2 espaços).
+            # O JSON é codificado antes de gravar qualquer arquivo, para que um erro não deixe um .npz solto.
+            data = orjson.dumps(output_data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            if portfolio_series is not None:
+                # Os retornos acumulados vão em float32 (~7 dígitos significativos, suficientes para as curvas)
+                time_series = {
+                    'dates': portfolio_series.index.to_numpy().astype('datetime64[ns]').view(np.int64),
+                    'portfolio': portfolio_series.to_numpy(dtype=np.float32),
+                }
+                if benchmark_series is not None:
+                    time_series['benchmark'] = benchmark_series.to_numpy(dtype=np.float32)
+                # Gravado antes do JSON: se o JSON existe, o .npz a que ele se refere também existe
+                atomic_write(time_series_filename, lambda f: np.savez_compressed(f, **time_series))
+
+            atomic_write(filename, lambda f: f.write(data))
+            logger.info(f"Resultados da otimização e backtest salvos com sucesso em: {filename} (séries em {time_series_filename})")
             return output_data
         except Exception as e:
-            print(f"Erro ao salvar os resultados em JSON: {e}")
+            logger.error(f"Erro ao salvar os resultados: {e}")
             return None
 
 
+# Bases e otimizadores já construídos neste processo, para execuções repetidas de main_run (ex: varreduras
+# de parâmetros). As entradas guardam o DataFrame da base, o que mantém seu id() válido como chave.
+_base_data_cache = {}
+_optimizer_cache = {}
+OPTIMIZER_CACHE_SIZE = 8
 
 
+def _csv_signature(csv_path):
+    """Identifica a versão do CSV da base (caminho, mtime em ns e tamanho) para validar a cópia em Parquet."""
+    stat = os.stat(csv_path)
+    return {'csv_path': os.path.abspath(csv_path), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
 
 
+def load_base_data(csv_path='datas/dados_base.csv', parquet_path='cache/dados_base.parquet'):
+    """
+    Carrega a base histórica completa de `csv_path` (a mesma base gravada por `executar_pipeline_local`
+    e lida pelos notebooks). A leitura usa uma cópia em Parquet (colunas já tipadas) derivada do CSV:
+    o arquivo `<parquet_path>.json` guarda a versão do CSV (mtime e tamanho) que gerou a cópia, e ela só é
+    usada se essa versão for a atual. Caso contrário, lê o CSV com os tipos definidos na leitura e
+    regrava o Parquet. Enquanto o CSV não muda, chamadas seguintes no mesmo processo devolvem o mesmo
+    DataFrame (que não deve ser alterado por quem o recebe).
+
+    Args:
+        csv_path (str, optional): Caminho do CSV da base histórica.
+        parquet_path (str, optional): Caminho da cópia em Parquet (em cache/, fora do controle de versão).
+
+    Returns:
+        pd.DataFrame: Base histórica com as colunas Date, Close, High, Low, Open, Volume e ticker.
+    """
+    signature = _csv_signature(csv_path)
+    key = (parquet_path,) + tuple(signature.values())
+    if key in _base_data_cache:
+        return _base_data_cache[key]
+    _base_data_cache.clear()
+
+    signature_path = parquet_path + '.json'
+    if os.path.exists(parquet_path) and os.path.exists(signature_path):
+        with open(signature_path, 'rb') as f:
+            cached_signature = orjson.loads(f.read())
+        if cached_signature == signature:
+            df_total = pd.read_parquet(parquet_path)
+            _base_data_cache[key] = df_total
+            return df_total
+
+    df_total = pd.read_csv(csv_path, parse_dates=['Date'], date_format='ISO8601',
+                           dtype={'Close': 'float64', 'High': 'float64', 'Low': 'float64', 'Open': 'float64',
+                                  'Volume': 'int64', 'ticker': 'string'})
+    try:
+        os.makedirs(os.path.dirname(parquet_path) or '.', exist_ok=True)
+        # Invalida a assinatura antiga antes de sobrescrever a cópia
+        if os.path.exists(signature_path):
+            os.remove(signature_path)
+        atomic_write(parquet_path, lambda f: df_total.to_parquet(f, index=False))
+        atomic_write(signature_path, lambda f: f.write(orjson.dumps(signature)))
+    except OSError as e:
+        logger.warning(f"Aviso: não foi possível gravar a cópia em Parquet da base ({e}).")
+    _base_data_cache[key] = df_total
+    return df_total
+
+
+def cached_optimizer(df_total, tickers_list, benchmark_ticker, risk_free_rate=RISK_FREE_RATE):
+    """
+    Devolve um PortfolioOptimizer para a base e os parâmetros dados, reaproveitando o já construído
+    neste processo para o mesmo DataFrame (mesmo objeto), tickers, benchmark e taxa livre de risco.
+    O otimizador não é alterado depois de construído, então pode ser compartilhado entre execuções.
+    Guarda no máximo OPTIMIZER_CACHE_SIZE otimizadores (descarta o mais antigo).
+    """
+    key = (id(df_total), tuple(tickers_list), benchmark_ticker, risk_free_rate)
+    if key in _optimizer_cache:
+        return _optimizer_cache[key][1]
+
+    optimizer = PortfolioOptimizer(data_file=df_total, tickers_list=tickers_list,
+                                   benchmark_ticker=benchmark_ticker, risk_free_rate=risk_free_rate)
+    if len(_optimizer_cache) >= OPTIMIZER_CACHE_SIZE:
+        del _optimizer_cache[next(iter(_optimizer_cache))]
+    _optimizer_cache[key] = (df_total, optimizer)
+    return optimizer
+
+
+def _ml_pipeline(optimizer):
+    """
+    Etapas de ML do `main_run` (preparação das features, treino dos modelos e otimização com base
+    nas previsões), em uma função de módulo para poder rodar em outro processo.
+
+    Returns:
+        tuple: (resultados da otimização com ML ou None se a etapa for pulada, DataFrame de features).
+    """
+    # --- 5. Preparação e Treinamento dos Modelos de ML (Opcional) ---
+    # Inicializa variáveis para o caso de a etapa de ML ser pulada.
+    features_df = pd.DataFrame()
+    ml_optimization_results = None
+
+    # Verifica se há dados suficientes para as janelas de features e target do ML (ver MIN_DAYS_FOR_ML).
+    # O número de dias vem direto do array de retornos, sem montar o DataFrame de returns_data.
+    num_days = optimizer.returns_array.shape[0]
+    if num_days < MIN_DAYS_FOR_ML:
+         logger.warning(f"Dados de retorno insuficientes ({num_days} dias) para a etapa de Machine Learning completa. Pulando ML.")
+         logger.warning(f"São necessários pelo menos {MIN_DAYS_FOR_ML} dias de histórico para as configurações atuais de features/target/split.")
+    else:
+        features_df, targets_dict = optimizer.prepare_ml_features()
+        if not features_df.empty and targets_dict:
+            ml_models_dict, _ml_performance = optimizer.train_ml_models(features_df, targets_dict)
+            if ml_models_dict:
+                # --- 6. Otimização com Base em ML ---
+                ml_optimization_results = optimizer.optimize_ml_portfolio(ml_models_dict, features_df)
+            else:
+                logger.warning("Não foi possível treinar os modelos de ML. A otimização baseada em ML será pulada.")
+        else:
+            logger.warning("Não foi possível preparar features ou targets para ML. A otimização baseada em ML será pulada.")
+
+    return ml_optimization_results, features_df
+
 
 def main_run():
     """
@@ -556,122 +1212,90 @@ def main_run():
     Esta função configura os parâmetros, cria/carrega os dados, executa as otimizações
     e os backtests, e salva os resultados.
     """
-    print("\n" + "="*80)
-    print("INICIANDO EXEMPLO DE EXECUÇÃO DO OTIMIZADOR DE PORTFÓLIO")
-    print("="*80 + "\n")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(_BANNER)
+        logger.info("INICIANDO EXEMPLO DE EXECUÇÃO DO OTIMIZADOR DE PORTFÓLIO")
+        logger.info(_BANNER)
 
     # --- 1. Configuração dos Parâmetros do Portfólio ---
     # Lista de tickers dos ativos que você deseja incluir no seu portfólio.
     # Exemplo: Ações de tecnologia e o S&P 500 como benchmark.
     USER_TICKERS = ['AAPL', 'GOOG', 'AMZN', 'NFLX', 'MSFT', 'IBM']
     BENCHMARK_TICKER = '^GSPC' # Ticker do S&P 500 no Yahoo Finance
-    ALL_TICKERS_FOR_DATA_SIMULATION = USER_TICKERS + [BENCHMARK_TICKER]
-
-    # Período para os dados históricos
-    START_DATE_DATA = '2007-01-01'
-    END_DATE_DATA = '2025-04-30'
-
-   
-    #Para usar a base localmente
 
-
-    df_total = pd.read_csv('datas/dados_base.csv')
-
-    #Ajustar os tipos de colunas
-    df_total['Date'] = pd.to_datetime(df_total['Date'])
-    df_total['Close'] = df_total['Close'].astype(float)
-    df_total['High'] = df_total['High'].astype(float)
-    df_total['Low'] = df_total['Low'].astype(float)
-    df_total['Open'] = df_total['Open'].astype(float)
-    df_total['Volume'] = df_total['Volume'].astype(int)
-    df_total['ticker'] = df_total['ticker'].astype(str)
+    # --- 2. Carga da Base Histórica (local, com todo o período disponível) ---
+    # Tipos já persistidos no Parquet (ou definidos na leitura do CSV): sem conversões depois da carga
+    df_total = load_base_data()
 
 
     # --- 3. Inicialização do Otimizador ---
     try:
         # Cria uma instância da classe PortfolioOptimizer, passando os dados e parâmetros.
-        optimizer = PortfolioOptimizer(df_total_data=df_total,
-                                       tickers_list=USER_TICKERS,
-                                       benchmark_ticker=BENCHMARK_TICKER,
-                                       risk_free_rate=RISK_FREE_RATE)
+        # Reaproveitado entre execuções de main_run no mesmo processo (ver cached_optimizer)
+        optimizer = cached_optimizer(df_total,
+                                     tickers_list=USER_TICKERS,
+                                     benchmark_ticker=BENCHMARK_TICKER,
+                                     risk_free_rate=RISK_FREE_RATE)
     except ValueError as e:
-        print(f"Erro ao inicializar o PortfolioOptimizer: {e}")
-        print("Verifique os dados de entrada e os tickers fornecidos.")
+        logger.error(f"Erro ao inicializar o PortfolioOptimizer: {e}")
+        logger.error("Verifique os dados de entrada e os tickers fornecidos.")
         return
 
-    # --- 4. Otimização de Markowitz ---
-    markowitz_results = optimizer.optimize_markowitz()
-
-    # --- 5. Preparação e Treinamento dos Modelos de ML (Opcional) ---
-    # Inicializa variáveis para o caso de a etapa de ML ser pulada.
-    features_df = pd.DataFrame()
-    targets_dict = {}
-    ml_models_dict = {}
-    ml_optimization_results = None
-
-    # Verifica se há dados suficientes para as janelas de features e target do ML.
-    # Este valor (ex: 150) é uma heurística; pode precisar de ajuste.
-    MIN_DAYS_FOR_ML = 90 + 30 + 30 + 60 # Aprox: maior janela feature + janela target + período de teste
-    if len(optimizer.returns_data) < MIN_DAYS_FOR_ML:
-         print(f"\nDados de retorno insuficientes ({len(optimizer.returns_data)} dias) para a etapa de Machine Learning completa. Pulando ML.")
-         print(f"São necessários pelo menos {MIN_DAYS_FOR_ML} dias de histórico para as configurações atuais de features/target/split.")
-    else:
-        features_df, targets_dict = optimizer.prepare_ml_features()
-        if not features_df.empty and targets_dict:
-            ml_models_dict, _ml_performance = optimizer.train_ml_models(features_df, targets_dict)
-            if ml_models_dict:
-                # --- 6. Otimização com Base em ML ---
-                ml_optimization_results = optimizer.optimize_ml_portfolio(ml_models_dict, features_df)
-            else:
-                print("Não foi possível treinar os modelos de ML. A otimização baseada em ML será pulada.")
-        else:
-            print("Não foi possível preparar features ou targets para ML. A otimização baseada em ML será pulada.")
+    # --- 4. a 6. Otimização de Markowitz e Otimização com Base em ML ---
+    # As duas etapas são independentes até o backtest e rodam em processos separados (fora do GIL),
+    # cada uma em um núcleo: o otimizador é enviado a cada processo por pickle.
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        markowitz_future = executor.submit(optimizer.optimize_markowitz)
+        ml_future = executor.submit(_ml_pipeline, optimizer)
+        markowitz_results = markowitz_future.result()
+        ml_optimization_results, features_df = ml_future.result()
 
     # --- 7. Backtesting das Estratégias ---
     # Definir a data de início do backtest.
     # Idealmente, o backtest deve começar após o período usado para treinar os modelos de ML
     # ou após um período inicial de estabilização dos dados para Markowitz.
     # Se features de ML foram criadas, usamos a primeira data delas como início do backtest.
+    # (datas formatadas direto do datetime64 do índice, sem criar Timestamps)
     backtest_start_date = None
     if not features_df.empty:
-        backtest_start_date = features_df.index[0].strftime('%Y-%m-%d')
-        print(f"\nDefinindo data de início do backtest como {backtest_start_date} (início das features de ML).")
-    elif not optimizer.returns_data.empty and len(optimizer.returns_data) > 252: # Pelo menos 1 ano de dados
+        backtest_start_date = str(np.datetime_as_string(features_df.index.values[0], unit='D'))
+        logger.info(f"Definindo data de início do backtest como {backtest_start_date} (início das features de ML).")
+    elif len(optimizer.returns_dates) > 252: # Pelo menos 1 ano de dados
         # Fallback: Se não houver features de ML, inicia o backtest após o primeiro ano de dados.
-        backtest_start_date = optimizer.returns_data.index[252].strftime('%Y-%m-%d')
-        print(f"\nAviso: Features de ML não disponíveis. Definindo data de início do backtest como {backtest_start_date} (após 1 ano de dados).")
+        backtest_start_date = str(np.datetime_as_string(optimizer.returns_dates.values[252], unit='D'))
+        logger.warning(f"Aviso: Features de ML não disponíveis. Definindo data de início do backtest como {backtest_start_date} (após 1 ano de dados).")
     else:
-        print("\nAviso: Não foi possível determinar uma data de início adequada para o backtest. O backtest pode usar todo o período de dados.")
+        logger.warning("Aviso: Não foi possível determinar uma data de início adequada para o backtest. O backtest pode usar todo o período de dados.")
 
-    # Backtest para Markowitz
+    # Backtest das duas estratégias no mesmo período, em uma única passada (ver backtest_portfolios)
+    strategies = {}
     if markowitz_results and markowitz_results.get('weights'):
-        print(f"\nExecutando backtest para a estratégia de Markowitz...")
-        markowitz_backtest_results = optimizer.backtest_portfolio(
-            weights_input=markowitz_results['weights'], 
-            start_date_str=backtest_start_date
-        )
-        if markowitz_backtest_results:
-            optimizer.save_results(markowitz_results, markowitz_backtest_results, 'markowitz_full_script_results.json')
+        strategies['markowitz'] = (markowitz_results, 'markowitz_full_script_results.json')
     else:
-        print("\nNão há resultados da otimização de Markowitz para realizar backtest.")
-    
-    # Backtest para Machine Learning
+        logger.warning("Não há resultados da otimização de Markowitz para realizar backtest.")
     if ml_optimization_results and ml_optimization_results.get('weights'):
-        print(f"\nExecutando backtest para a estratégia baseada em Machine Learning...")
-        ml_backtest_results = optimizer.backtest_portfolio(
-            weights_input=ml_optimization_results['weights'], 
-            start_date_str=backtest_start_date
-        )
-        if ml_backtest_results:
-            optimizer.save_results(ml_optimization_results, ml_backtest_results, 'ml_full_script_results.json')
+        strategies['ml'] = (ml_optimization_results, 'ml_full_script_results.json')
     else:
-        print("\nNão há resultados da otimização baseada em ML para realizar backtest.")
+        logger.warning("Não há resultados da otimização baseada em ML para realizar backtest.")
+
+    if strategies:
+        logger.info(f"Executando backtest para as estratégias: {', '.join(strategies)}...")
+        backtest_results_by_strategy = optimizer.backtest_portfolios(
+            {name: optimization_results['weights'] for name, (optimization_results, _) in strategies.items()},
+            start_date_str=backtest_start_date,
+            plot=True
+        )
+        for name, (optimization_results, filename) in strategies.items():
+            if backtest_results_by_strategy[name]:
+                optimizer.save_results(optimization_results, backtest_results_by_strategy[name], filename)
 
-    print("\n" + "="*80)
-    print("EXECUÇÃO DO EXEMPLO DO OTIMIZADOR DE PORTFÓLIO CONCLUÍDA")
-    print("="*80 + "\n")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(_BANNER)
+        logger.info("EXECUÇÃO DO EXEMPLO DO OTIMIZADOR DE PORTFÓLIO CONCLUÍDA")
+        logger.info(_BANNER)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=(os.environ.get('LOGLEVEL') or 'WARNING').upper(), format='%(message)s')
     main_run()
 
@@ -0,0 +1,34 @@
+"""
+Kernel numérico compilado com Numba usado no backtest do portfólio.
+
+Assim como em `models/_ml_kernels.py`, não são usados `parallel=True` (a camada de threads do
+Numba não é segura para fork com `gunicorn --preload`) nem `fastmath` (mudaria a ordem das contas).
+"""
+
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def cumulative_drawdown(daily_returns, cumulative_out):
+    """
+    Em uma única passada sobre os retornos diários, escreve o retorno acumulado de cada dia em
+    `cumulative_out` ((1 + r1) * ... * (1 + rt)) e devolve o máximo drawdown, isto é, a maior queda
+    percentual do acumulado em relação ao maior valor atingido até o dia (o primeiro dia inclusive).
+    """
+    equity = 1.0
+    peak = -np.inf
+    max_drawdown = 0.0
+    for t in range(daily_returns.shape[0]):
+        equity *= 1.0 + daily_returns[t]
+        cumulative_out[t] = equity
+        if equity > peak:
+            peak = equity
+        drawdown = (equity - peak) / peak
+        if drawdown < max_drawdown:
+            max_drawdown = drawdown
+    return max_drawdown
+
+
+# Compila o kernel na importação para que a primeira chamada não pague o tempo de JIT
+cumulative_drawdown(np.zeros(1), np.empty(1))
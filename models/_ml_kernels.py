@@ -0,0 +1,53 @@
+"""
+Kernel numérico compilado com Numba usado na preparação das features de ML.
+
+`build_features` recebe a matriz de retornos (dias x tickers) em float64 e escreve todas as
+features de janela móvel (somas e desvios padrão amostrais) diretamente na matriz de saída,
+em uma única varredura da série por feature: a soma da janela é mantida corrente, somando o
+retorno que entra e subtraindo o que sai (O(dias) independentemente do tamanho da janela).
+Os retornos chegam sem NaN (load_data preenche os preços e descarta a primeira linha).
+
+O kernel não usa `parallel=True` nem `fastmath`: a camada de threads do Numba não é segura
+para fork, e a API é servida com `gunicorn --preload`, que faz fork depois de importar este
+módulo; `fastmath` permitiria reordenar as somas e mudar os resultados.
+"""
+
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def build_features(R, windows, is_vol, first_row, out):
+    """
+    Preenche `out` (dias - first_row x tickers * n_features) com, para cada ticker e na ordem de
+    `windows`, a soma (is_vol False) ou o desvio padrão amostral, ddof=1 (is_vol True), dos
+    retornos na janela terminada em cada dia a partir de `first_row`.
+    """
+    T, K = R.shape
+    F = windows.shape[0]
+    for k in range(K):
+        for f in range(F):
+            window = windows[f]
+            col = k * F + f
+            s = 0.0
+            ss = 0.0
+            for t in range(T):
+                x = R[t, k]
+                s += x
+                ss += x * x
+                if t >= window:
+                    old = R[t - window, k]
+                    s -= old
+                    ss -= old * old
+                if t < first_row:
+                    continue
+                if is_vol[f]:
+                    # var = (soma(x²) - soma(x)²/n) / (n - 1); arredondamentos podem deixá-la levemente negativa
+                    var = (ss - s * s / window) / (window - 1)
+                    out[t - first_row, col] = np.sqrt(var) if var > 0.0 else 0.0
+                else:
+                    out[t - first_row, col] = s
+
+
+# Compila o kernel na importação para que a primeira requisição da API não pague o tempo de JIT
+build_features(np.zeros((2, 1)), np.array([2], dtype=np.int64), np.array([True]), 1, np.empty((1, 1)))
@@ -0,0 +1,99 @@
+"""
+Conversão dos modelos de ML treinados (Random Forest por ticker) para ONNX.
+
+A predição de uma única linha com o scikit-learn percorre cada árvore da floresta em Python,
+o que domina a latência do endpoint de predição. O ONNX Runtime executa o ensemble inteiro
+em código nativo, com o mesmo resultado numérico (em float32, que já é o tipo usado
+internamente pelas árvores do scikit-learn).
+
+Uso (gera um ml_model_<TICKER>.onnx ao lado de cada ml_model_<TICKER>.joblib):
+    python -m models.modelos_onnx
+"""
+
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+try:
+    import onnxruntime as ort
+except ImportError:  # onnxruntime é opcional: sem ele a API usa os modelos .joblib
+    ort = None
+
+try:
+    from models.PortfolioOptimizer import MODELS_DIR
+except ModuleNotFoundError as e:
+    # Importado de dentro de models/ (notebooks): sem o pacote models
+    if e.name != 'models':
+        raise
+    from PortfolioOptimizer import MODELS_DIR
+
+
+class ModeloOnnx:
+    """
+    Envolve uma sessão do ONNX Runtime com a mesma interface `predict` dos modelos do scikit-learn,
+    para que `PortfolioOptimizer.optimize_ml_portfolio` funcione sem alterações.
+    """
+
+    def __init__(self, onnx_path):
+        # Um thread por sessão: o paralelismo fica entre tickers (optimize_ml_portfolio), sem oversubscription
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = 1
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        # Ordem das colunas usada no treino, gravada na exportação
+        self.feature_names_in_ = json.loads(metadata['feature_names']) if 'feature_names' in metadata else None
+        self.feature_index = pd.Index(self.feature_names_in_) if self.feature_names_in_ is not None else None
+
+    def predict(self, X):
+        # Reordena as colunas apenas se necessário: no caso comum (features geradas por prepare_ml_features)
+        # a ordem já é a do treino e o array do DataFrame é usado diretamente, sem cópia.
+        if self.feature_index is not None and hasattr(X, 'columns') and not X.columns.equals(self.feature_index):
+            X = X[self.feature_names_in_]
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        return self.session.run(None, {self.input_name: X})[0].ravel().astype(np.float64)
+
+
+def onnx_path_for(model_path):
+    return os.path.splitext(model_path)[0] + '.onnx'
+
+
+def usar_onnx(model_path):
+    """True se o onnxruntime está instalado e a versão ONNX do modelo existe e não é mais antiga que o .joblib."""
+    onnx_path = onnx_path_for(model_path)
+    return ort is not None and os.path.exists(onnx_path) and os.path.getmtime(onnx_path) >= os.path.getmtime(model_path)
+
+
+def carregar_modelo(model_path):
+    """Carrega o modelo de um .joblib, usando a versão ONNX quando ela pode ser usada (ver `usar_onnx`)."""
+    if usar_onnx(model_path):
+        return ModeloOnnx(onnx_path_for(model_path))
+    return joblib.load(model_path, mmap_mode='r')
+
+
+def exportar_modelos_onnx(models_dir=MODELS_DIR):
+    from skl2onnx import to_onnx
+    from skl2onnx.common.data_types import FloatTensorType
+
+    for filename in sorted(os.listdir(models_dir)):
+        if not filename.endswith('.joblib'):
+            continue
+        model_path = os.path.join(models_dir, filename)
+        model = joblib.load(model_path)
+
+        onx = to_onnx(model, initial_types=[('X', FloatTensorType([None, model.n_features_in_]))])
+        if hasattr(model, 'feature_names_in_'):
+            meta = onx.metadata_props.add()
+            meta.key = 'feature_names'
+            meta.value = json.dumps(list(model.feature_names_in_))
+
+        with open(onnx_path_for(model_path), 'wb') as f:
+            f.write(onx.SerializeToString())
+        print(f"Modelo exportado: {onnx_path_for(model_path)}")
+
+
+if __name__ == "__main__":
+    exportar_modelos_onnx()